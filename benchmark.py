@@ -0,0 +1,417 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import builtins
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Benchmark of script.py against a local stand-in of the Organizations, Account Management, STS and S3 APIs.
+# The script runs unmodified in a child process per scenario, with AWS_ENDPOINT_URL pointing to the local server.
+
+SCENARIOS = ['startup', 'list', 'update', 'delete', 'report']
+ALTERNATE_CONTACT_TYPES = ['BILLING', 'OPERATIONS', 'SECURITY']
+MANAGEMENT_ACCOUNT_ID = '100000000000'
+ROOT_ID = 'r-bnch'
+OU_COUNT = 10
+
+# Error raised by the simulated APIs, returned in the wire format of the service
+class SimulatedError(Exception):
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+# Token bucket of the simulated per-operation TPS quotas
+class Quota:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+# Synthetic Organization: accounts spread over OUs under the root, alternate contacts set on two out of three accounts
+class SimulatedOrganization:
+    def __init__(self, size=0, latency=0.0, tps=0.0, throttle_probability=0.0):
+        self.lock = threading.Lock()
+        self.reset(size, latency, tps, throttle_probability)
+
+    def reset(self, size, latency, tps, throttle_probability):
+        with self.lock:
+            self.latency = latency
+            self.tps = tps
+            self.throttle_probability = throttle_probability
+            self.quotas = {}
+            self.calls = {}
+            self.throttled = {}
+            self.s3_bytes = 0
+            self.uploads = {}
+            self.pending_emails = {}
+            self.accounts = [str(int(MANAGEMENT_ACCOUNT_ID) + x) for x in range(size)]
+            self.alternate_contacts = {}
+            self.contact_information = {}
+            self.primary_emails = {}
+            for index, account_id in enumerate(self.accounts):
+                self.contact_information[account_id] = {
+                    'AddressLine1': f'{index} Main Street',
+                    'City': 'Seattle',
+                    'CountryCode': 'US',
+                    'FullName': f'Owner {index}',
+                    'PhoneNumber': '+12025550100',
+                    'PostalCode': '98101'
+                }
+                self.primary_emails[account_id] = f'root+{account_id}@example.com'
+                if index % 3:
+                    for contact_type in ALTERNATE_CONTACT_TYPES:
+                        self.alternate_contacts[(account_id, contact_type)] = {
+                            'AlternateContactType': contact_type,
+                            'EmailAddress': f'{contact_type.lower()}.team@example.com',
+                            'Name': f'{contact_type.capitalize()} Team',
+                            'PhoneNumber': '+12025550100',
+                            'Title': f'{contact_type.capitalize()} Internal Team'
+                        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'throttled': dict(self.throttled),
+                'total_calls': sum(self.calls.values()),
+                'total_throttled': sum(self.throttled.values()),
+                's3_bytes': self.s3_bytes
+            }
+
+    # Counts the call, sleeps the injected latency and throttles like the real quotas would
+    def admit(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if self.tps and operation not in self.quotas:
+                self.quotas[operation] = Quota(self.tps)
+            quota = self.quotas.get(operation)
+        if self.latency:
+            time.sleep(self.latency)
+        if (quota and not quota.try_acquire()) or random.random() < self.throttle_probability:
+            with self.lock:
+                self.throttled[operation] = self.throttled.get(operation, 0) + 1
+            raise SimulatedError('TooManyRequestsException', 'Rate exceeded', 429)
+
+    def account_in_organization(self, account_id):
+        if account_id not in self.contact_information:
+            raise SimulatedError('AccessDeniedException', f'Account {account_id} is not a member of the organization', 403)
+        return account_id
+
+    def account(self, operation, params):
+        account_id = self.account_in_organization(params.get('AccountId', MANAGEMENT_ACCOUNT_ID))
+        if operation == 'GetAlternateContact':
+            contact = self.alternate_contacts.get((account_id, params['AlternateContactType']))
+            if contact is None:
+                raise SimulatedError('ResourceNotFoundException', 'No contact of the requested type found', 404)
+            return {'AlternateContact': contact}
+        elif operation == 'PutAlternateContact':
+            self.alternate_contacts[(account_id, params['AlternateContactType'])] = {key: params[key] for key in ('AlternateContactType', 'EmailAddress', 'Name', 'PhoneNumber', 'Title')}
+            return {}
+        elif operation == 'DeleteAlternateContact':
+            if self.alternate_contacts.pop((account_id, params['AlternateContactType']), None) is None:
+                raise SimulatedError('ResourceNotFoundException', 'No contact of the requested type found', 404)
+            return {}
+        elif operation == 'GetContactInformation':
+            return {'ContactInformation': self.contact_information[account_id]}
+        elif operation == 'PutContactInformation':
+            self.contact_information[account_id] = params['ContactInformation']
+            return {}
+        elif operation == 'GetPrimaryEmail':
+            return {'PrimaryEmail': self.primary_emails[account_id]}
+        # The simulated OTP of an account is the last 6 digits of its ID
+        elif operation == 'StartPrimaryEmailUpdate':
+            self.pending_emails[account_id] = params['PrimaryEmail']
+            return {'Status': 'PENDING'}
+        elif operation == 'AcceptPrimaryEmailUpdate':
+            if self.pending_emails.get(account_id) != params['PrimaryEmail'] or params['Otp'] != account_id[-6:]:
+                raise SimulatedError('ValidationException', 'The OTP is not valid')
+            self.primary_emails[account_id] = self.pending_emails.pop(account_id)
+            return {'Status': 'ACCEPTED'}
+        raise SimulatedError('UnknownOperationException', f'{operation} is not simulated')
+
+    def account_summary(self, account_id):
+        index = int(account_id) - int(MANAGEMENT_ACCOUNT_ID)
+        return {
+            'Id': account_id,
+            'Arn': f'arn:aws:organizations::{MANAGEMENT_ACCOUNT_ID}:account/o-bench/{account_id}',
+            'Email': self.primary_emails[account_id],
+            'Name': f'Account {index}',
+            'Status': 'ACTIVE',
+            'JoinedMethod': 'CREATED',
+            'JoinedTimestamp': 1600000000 + index
+        }
+
+    # Pages of 20 results with the start index as NextToken, like the real default page size
+    def page(self, key, items, params):
+        start = int(params.get('NextToken', '0'))
+        end = start + min(int(params.get('MaxResults', 20)), 20)
+        resp = {key: items[start:end]}
+        if end < len(items):
+            resp['NextToken'] = str(end)
+        return resp
+
+    # Account parents: the management account is in the root, the others in ou-bnch-0000000<index % 10>,
+    # or in its nested OU ou-bnch-1000000<index % 10> when the tens digit of the index is odd
+    def parent_accounts(self, parent_id):
+        if parent_id == ROOT_ID:
+            return self.accounts[:1]
+        match = re.fullmatch(r'ou-bnch-([01])000000(\d)', parent_id)
+        if not match:
+            raise SimulatedError('ParentNotFoundException', f'{parent_id} not found')
+        return [x for index, x in enumerate(self.accounts) if index and index % OU_COUNT == int(match.group(2)) and index // OU_COUNT % 2 == int(match.group(1))]
+
+    def parent_units(self, parent_id):
+        if parent_id == ROOT_ID:
+            return [{'Id': f'ou-bnch-0000000{x}', 'Name': f'OU {x}'} for x in range(OU_COUNT)]
+        match = re.fullmatch(r'ou-bnch-([01])000000(\d)', parent_id)
+        if not match:
+            raise SimulatedError('ParentNotFoundException', f'{parent_id} not found')
+        return [{'Id': f'ou-bnch-1000000{match.group(2)}', 'Name': f'OU {match.group(2)} nested'}] if match.group(1) == '0' else []
+
+    def organizations(self, operation, params):
+        if operation == 'ListAccounts':
+            return self.page('Accounts', [self.account_summary(x) for x in self.accounts], params)
+        elif operation == 'ListAccountsForParent':
+            return self.page('Accounts', [self.account_summary(x) for x in self.parent_accounts(params['ParentId'])], params)
+        elif operation == 'ListRoots':
+            return {'Roots': [{'Id': ROOT_ID, 'Name': 'Root', 'Arn': f'arn:aws:organizations::{MANAGEMENT_ACCOUNT_ID}:root/o-bench/{ROOT_ID}'}]}
+        elif operation == 'ListOrganizationalUnitsForParent':
+            return self.page('OrganizationalUnits', self.parent_units(params['ParentId']), params)
+        elif operation == 'ListTagsForResource':
+            if params['ResourceId'] not in self.primary_emails:
+                raise SimulatedError('TargetNotFoundException', f'{params["ResourceId"]} not found')
+            index = int(params['ResourceId']) - int(MANAGEMENT_ACCOUNT_ID)
+            return {'Tags': [{'Key': 'env', 'Value': 'prod' if index % 2 else 'dev'}, {'Key': 'team', 'Value': f'team-{index % 3}'}]}
+        raise SimulatedError('UnknownOperationException', f'{operation} is not simulated')
+
+    # S3 objects are not kept, only their size is counted
+    def s3(self, method, query, body):
+        if method == 'POST' and 'uploads' in query:
+            upload_id = f'upload-{len(self.uploads) + 1}'
+            self.uploads[upload_id] = 0
+            return {'UploadId': upload_id}
+        elif method == 'PUT' and 'uploadId' in query:
+            self.uploads[query['uploadId'][0]] += len(body)
+        elif method == 'POST' and 'uploadId' in query:
+            self.s3_bytes += self.uploads.pop(query['uploadId'][0])
+        elif method == 'DELETE' and 'uploadId' in query:
+            self.uploads.pop(query['uploadId'][0], None)
+        elif method == 'PUT':
+            self.s3_bytes += len(body)
+        return {}
+
+organization = SimulatedOrganization()
+
+# HTTP handler speaking the JSON (Organizations), REST-JSON (Account Management), query (STS) and REST-XML (S3) protocols
+class SimulatedAwsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type='application/json', headers=None):
+        data = body if isinstance(body, bytes) else body.encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('x-amzn-RequestId', 'benchmark')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlparse(self.path)
+        if url.path.startswith('/__benchmark/'):
+            return self.handle_control(url, body)
+        match = re.search(r'Credential=[^/]+/[^/]+/[^/]+/([^/]+)/aws4_request', self.headers.get('Authorization', ''))
+        service = match.group(1) if match else 's3'
+        try:
+            if service == 'organizations':
+                operation = self.headers['X-Amz-Target'].split('.')[-1]
+                organization.admit(operation)
+                return self.send(200, json.dumps(organization.organizations(operation, json.loads(body or b'{}'))), 'application/x-amz-json-1.1')
+            elif service == 'account':
+                operation = url.path.strip('/')[0].upper() + url.path.strip('/')[1:]
+                organization.admit(operation)
+                return self.send(200, json.dumps(organization.account(operation, json.loads(body or b'{}'))))
+            elif service == 'sts':
+                organization.admit('GetCallerIdentity')
+                return self.send(200, (
+                    '<GetCallerIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/"><GetCallerIdentityResult>'
+                    f'<Arn>arn:aws:iam::{MANAGEMENT_ACCOUNT_ID}:user/benchmark</Arn><UserId>BENCHMARK</UserId><Account>{MANAGEMENT_ACCOUNT_ID}</Account>'
+                    '</GetCallerIdentityResult><ResponseMetadata><RequestId>benchmark</RequestId></ResponseMetadata></GetCallerIdentityResponse>'
+                ), 'text/xml')
+            else:
+                query = parse_qs(url.query, keep_blank_values=True)
+                organization.admit(f'S3:{self.command}')
+                resp = organization.s3(self.command, query, body)
+                if 'UploadId' in resp:
+                    return self.send(200, f'<InitiateMultipartUploadResult><Bucket>b</Bucket><Key>k</Key><UploadId>{resp["UploadId"]}</UploadId></InitiateMultipartUploadResult>', 'application/xml')
+                elif self.command == 'POST' and 'uploadId' in query:
+                    return self.send(200, '<CompleteMultipartUploadResult><ETag>"benchmark"</ETag></CompleteMultipartUploadResult>', 'application/xml')
+                return self.send(204 if self.command == 'DELETE' else 200, b'', 'application/xml', {'ETag': '"benchmark"'})
+        except SimulatedError as e:
+            if service == 'organizations':
+                return self.send(400 if e.status == 429 else e.status, json.dumps({'__type': e.code, 'Message': e.message}), 'application/x-amz-json-1.1')
+            elif service == 's3':
+                return self.send(503 if e.status == 429 else e.status, f'<Error><Code>{"SlowDown" if e.status == 429 else e.code}</Code><Message>{e.message}</Message></Error>', 'application/xml')
+            return self.send(e.status, json.dumps({'message': e.message}), headers={'x-amzn-ErrorType': e.code})
+
+    # Control endpoints of the benchmark runner: reset the Organization and read the call counters
+    def handle_control(self, url, body):
+        if url.path == '/__benchmark/reset':
+            organization.reset(**json.loads(body))
+            return self.send(200, '{}')
+        return self.send(200, json.dumps(organization.stats()))
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = handle_request
+
+# Start the simulated AWS endpoint on a free local port
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SimulatedAwsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def control(endpoint, path, payload=None):
+    request = urllib.request.Request(f'{endpoint}/__benchmark/{path}', data=json.dumps(payload).encode('UTF-8') if payload is not None else None)
+    with urllib.request.urlopen(request) as resp:
+        return json.loads(resp.read())
+
+# Runs one scenario of script.py in this (child) process and saves its wall time and peak RSS
+def run_scenario(scenario, result_path):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import script
+
+    # Answers of the interactive prompts: local file export for list, the new contact for update
+    answers = {
+        'list': ['n', 'y'],
+        'update': ['benchmark.team@example.com', 'Benchmark Team', '+12025550199', 'Benchmark Internal Team']
+    }.get(scenario, [])
+    builtins.input = lambda prompt='': answers.pop(0)
+
+    tic = time.perf_counter()
+    current_account_id = script.get_account_id()
+    accounts = script.list_accounts_func()
+    if scenario == 'list':
+        resp = script.alternate_contact_list_func(accounts, current_account_id, ['Billing', 'Operations', 'Security'])
+    elif scenario == 'update':
+        resp = script.alternate_contact_update_func(accounts, current_account_id, ['Billing', 'Operations', 'Security'])
+    elif scenario == 'delete':
+        resp = script.alternate_contact_delete_func(accounts, current_account_id, ['Billing', 'Operations', 'Security'], assume_yes=True)
+    else:
+        resp = script.generate_report(current_account_id, 'csv')
+    toc = time.perf_counter()
+
+    with open(result_path, 'w') as f:
+        json.dump({'success': resp == True, 'wall_time': toc - tic, 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, f)
+
+# Startup scenario: a headless lookup of one account's primary contact, timed from the start of the child process to its exit,
+# so that the interpreter start and the imports of script.py are included
+def run_startup(env, work_dir):
+    with open(os.path.join(work_dir, 'stderr.txt'), 'w+') as stderr:
+        tic = time.perf_counter()
+        child = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script.py'), 'list', 'primary', str(int(MANAGEMENT_ACCOUNT_ID) + 1)], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, rusage = os.wait4(child.pid, 0)
+        toc = time.perf_counter()
+        child.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        return child, stderr.read(), {'success': child.returncode == 0, 'wall_time': toc - tic, 'peak_rss_kb': rusage.ru_maxrss}
+
+# Runs every scenario for every Organization size in its own child process, so that the peak RSS is per scenario
+def run_benchmark(args):
+    server = start_server()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+    results = []
+
+    print(f'{"Scenario":<10} {"Accounts":>8} {"Wall (s)":>9} {"API calls":>9} {"Throttled":>9} {"Peak RSS (MB)":>13} {"Calls/s":>9} {"Accounts/s":>10}')
+    for size in args.sizes:
+        for scenario in args.scenarios:
+            control(endpoint, 'reset', {'size': size, 'latency': args.latency, 'tps': args.server_tps, 'throttle_probability': args.throttle_probability})
+            with tempfile.TemporaryDirectory() as work_dir:
+                result_path = os.path.join(work_dir, 'result.json')
+                env = dict(
+                    os.environ,
+                    AWS_ENDPOINT_URL=endpoint,
+                    AWS_ACCESS_KEY_ID='benchmark',
+                    AWS_SECRET_ACCESS_KEY='benchmark',
+                    AWS_DEFAULT_REGION='us-east-1',
+                    CONTACTS_MANAGER_MAX_WORKERS=str(args.max_workers),
+                    CONTACTS_MANAGER_ACCOUNT_API_TPS=str(args.tps),
+                    CONTACTS_MANAGER_CACHE_TTL='0',
+                    CONTACTS_MANAGER_SNAPSHOT_DB=os.path.join(work_dir, 'snapshots.db')
+                )
+                env.pop('AWS_PROFILE', None)
+                if scenario == 'startup':
+                    child, stderr, result = run_startup(env, work_dir)
+                else:
+                    child = subprocess.run([sys.executable, os.path.abspath(__file__), '_run', scenario, result_path], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                    stderr = child.stderr
+                if child.returncode != 0 or not (scenario == 'startup' or os.path.exists(result_path)):
+                    print(f'{scenario:<10} {size:>8} failed: {stderr.strip().splitlines()[-1] if stderr.strip() else child.returncode}')
+                    continue
+                if scenario != 'startup':
+                    with open(result_path) as f:
+                        result = json.load(f)
+            stats = control(endpoint, 'stats')
+            result.update(scenario=scenario, accounts=size, api_calls=stats['total_calls'], throttled=stats['total_throttled'], calls=stats['calls'])
+            result['calls_per_second'] = result['api_calls'] / result['wall_time']
+            result['accounts_per_second'] = size / result['wall_time']
+            results.append(result)
+            print(f'{scenario:<10} {size:>8} {result["wall_time"]:>9.2f} {result["api_calls"]:>9} {result["throttled"]:>9} {result["peak_rss_kb"] / 1024:>13.1f} {result["calls_per_second"]:>9.0f} {result["accounts_per_second"]:>10.1f}{"" if result["success"] else "  (failed)"}')
+
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'settings': {key: value for key, value in vars(args).items() if key != 'output'}, 'results': results}, f, indent=2)
+        print(f'\nResults saved to {args.output}')
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '_run':
+        return run_scenario(sys.argv[2], sys.argv[3])
+
+    parser = argparse.ArgumentParser(description='Benchmark of script.py against a local simulated Organizations / Account Management / STS / S3 service.')
+    parser.add_argument('--sizes', type=lambda x: [int(y) for y in x.split(',')], default=[100, 1000, 10000], help='comma-separated Organization sizes (default: 100,1000,10000)')
+    parser.add_argument('--scenarios', type=lambda x: x.split(','), default=SCENARIOS, help=f'comma-separated scenarios (default: {",".join(SCENARIOS)})')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of latency added to every API call (default: 0.02)')
+    parser.add_argument('--server-tps', type=float, default=0, help='simulated TPS quota of every API operation, calls above it get TooManyRequestsException (default: no quota)')
+    parser.add_argument('--throttle-probability', type=float, default=0, help='probability of a random TooManyRequestsException (default: 0)')
+    parser.add_argument('--max-workers', type=int, default=32, help='CONTACTS_MANAGER_MAX_WORKERS of the script (default: 32)')
+    parser.add_argument('--tps', type=float, default=1000, help='CONTACTS_MANAGER_ACCOUNT_API_TPS of the script (default: 1000)')
+    parser.add_argument('--output', help='JSON file to save the results to')
+    args = parser.parse_args()
+    unknown_scenarios = set(args.scenarios) - set(SCENARIOS)
+    if unknown_scenarios:
+        parser.error(f'unknown scenario(s): {", ".join(sorted(unknown_scenarios))}')
+    run_benchmark(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,797 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import argparse
+import atexit
+import bisect
 import boto3
+import botocore.session
+import contextvars
+import csv
+import difflib
+import gzip
+import hashlib
 import json
 import logging
 import time
 import os
+import queue
 import re
-import openpyxl
-import pandas as pd
-from simple_term_menu import TerminalMenu
-from botocore.exceptions import ClientError
+import sqlite3
+import threading
+import zlib
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, CredentialResolver, RefreshableCredentials
+from botocore.exceptions import BotoCoreError, ClientError
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pprint import pprint
 
-# List all AWS Account IDs in Organizations
-def list_accounts_func():
-    list_of_accounts_id = []
+# Number of concurrent Account Management API calls (override with CONTACTS_MANAGER_MAX_WORKERS)
+MAX_WORKERS = int(os.environ.get('CONTACTS_MANAGER_MAX_WORKERS', '10'))
+
+# Requests per second allowed for each Account Management API operation (override with CONTACTS_MANAGER_ACCOUNT_API_TPS)
+ACCOUNT_API_TPS = float(os.environ.get('CONTACTS_MANAGER_ACCOUNT_API_TPS', '10'))
+
+# AWS SDK attempts per call (adaptive retry mode) and connect/read timeouts in seconds
+# (override with CONTACTS_MANAGER_MAX_ATTEMPTS, CONTACTS_MANAGER_CONNECT_TIMEOUT and CONTACTS_MANAGER_READ_TIMEOUT)
+MAX_ATTEMPTS = int(os.environ.get('CONTACTS_MANAGER_MAX_ATTEMPTS', '10'))
+CONNECT_TIMEOUT = float(os.environ.get('CONTACTS_MANAGER_CONNECT_TIMEOUT', '10'))
+READ_TIMEOUT = float(os.environ.get('CONTACTS_MANAGER_READ_TIMEOUT', '30'))
+
+# Only write the contacts that differ from the current ones, read before every update (disable with CONTACTS_MANAGER_DIFF_MODE=false)
+DIFF_MODE = os.environ.get('CONTACTS_MANAGER_DIFF_MODE', 'true').lower() in ('1', 'true', 'yes')
+
+# Token bucket rate limiter shared by the worker threads
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Upper bounds in seconds of the buckets of the API call latency histograms
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')]
+
+# Error codes counted as throttling
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown'}
+
+# JSON file the API metrics summary of every run is saved to (override with CONTACTS_MANAGER_METRICS_FILE or --metrics)
+METRICS_FILE = os.environ.get('CONTACTS_MANAGER_METRICS_FILE')
+
+# Per-operation API metrics (latency histogram, attempts, throttles and error codes), recorded from the botocore events of the shared clients
+class ApiMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.cache_hits = {}
+            self.started = time.perf_counter()
+
+    def register(self, client):
+        client.meta.events.register('before-call', self.before_call)
+        client.meta.events.register('response-received', self.response_received)
+        client.meta.events.register('after-call', self.after_call)
+        client.meta.events.register('after-call-error', self.after_call_error)
+
+    # Metrics of the operation of a botocore event name (e.g. after-call.account.GetAlternateContact), the lock must be held
+    def operation(self, event_name):
+        name = event_name.split('.', 1)[1]
+        if name not in self.operations:
+            self.operations[name] = {'calls': 0, 'attempts': 0, 'throttles': 0, 'errors': {}, 'latency_sum': 0.0, 'latency_max': 0.0, 'histogram': [0] * len(LATENCY_BUCKETS)}
+        return self.operations[name]
+
+    # The context is shared by all the attempts of a call, so the latency includes the retries
+    def before_call(self, event_name, context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    # Emitted for every attempt
+    def response_received(self, event_name, parsed_response, **kwargs):
+        error_code = (parsed_response or {}).get('Error', {}).get('Code')
+        with self.lock:
+            operation = self.operation(event_name)
+            operation['attempts'] += 1
+            if error_code in THROTTLING_ERROR_CODES:
+                operation['throttles'] += 1
+
+    def after_call(self, event_name, context, parsed, **kwargs):
+        self.record(event_name, context, parsed.get('Error', {}).get('Code'))
+
+    def after_call_error(self, event_name, context, exception, **kwargs):
+        self.record(event_name, context, type(exception).__name__)
+
+    def record(self, event_name, context, error_code):
+        latency = time.perf_counter() - context.get('metrics_started', time.perf_counter())
+        with self.lock:
+            operation = self.operation(event_name)
+            operation['calls'] += 1
+            operation['latency_sum'] += latency
+            operation['latency_max'] = max(operation['latency_max'], latency)
+            operation['histogram'][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            if error_code:
+                operation['errors'][error_code] = operation['errors'].get(error_code, 0) + 1
+
+    # Reads served by the response cache, without an API call
+    def record_cache_hit(self, operation):
+        with self.lock:
+            self.cache_hits[operation] = self.cache_hits.get(operation, 0) + 1
+
+    # Latency percentile, approximated by the upper bound of its histogram bucket
+    def percentile(self, operation, q):
+        rank = q * operation['calls']
+        count = 0
+        for upper_bound, bucket in zip(LATENCY_BUCKETS, operation['histogram']):
+            count += bucket
+            if count >= rank:
+                return min(upper_bound, operation['latency_max'])
+        return operation['latency_max']
+
+    def summary(self):
+        with self.lock:
+            operations = {}
+            for name, operation in sorted(self.operations.items()):
+                operations[name] = {
+                    'calls': operation['calls'],
+                    'attempts': operation['attempts'],
+                    'retries': max(0, operation['attempts'] - operation['calls']),
+                    'throttles': operation['throttles'],
+                    'errors': dict(operation['errors']),
+                    'latency': {
+                        'mean': operation['latency_sum'] / operation['calls'] if operation['calls'] else 0,
+                        'p50': self.percentile(operation, 0.5),
+                        'p90': self.percentile(operation, 0.9),
+                        'p99': self.percentile(operation, 0.99),
+                        'max': operation['latency_max'],
+                        'histogram': {f'le_{upper_bound:g}': bucket for upper_bound, bucket in zip(LATENCY_BUCKETS, operation['histogram'])}
+                    }
+                }
+            return {'wall_time': time.perf_counter() - self.started, 'operations': operations, 'cache_hits': dict(self.cache_hits)}
+
+api_metrics = ApiMetrics()
+
+# Runs one command of the menu or the CLI: times it and prints its outcome and API metrics. Returns True if it succeeded
+def run_command(func, *args):
+    tic = time.perf_counter()
+    api_metrics.reset()
+    resp = func(*args)
+    toc = time.perf_counter()
+    print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: something went wrong.\n')
+    report_metrics()
+    return resp == True
+
+# Prints the API metrics of the last run and saves them to the metrics file, if any
+def report_metrics():
+    summary = api_metrics.summary()
+    for name, operation in summary['operations'].items():
+        errors = ', '.join(f'{code}: {count}' for code, count in operation['errors'].items())
+        print(f'  {name}: {operation["calls"]} calls, p50 {operation["latency"]["p50"]:.3f}s, p99 {operation["latency"]["p99"]:.3f}s, {operation["retries"]} retries, {operation["throttles"]} throttled{f", errors: {errors}" if errors else ""}')
+    if summary['cache_hits']:
+        print(f'  Response cache: {", ".join(f"{name} {count} hits" for name, count in summary["cache_hits"].items())}')
+    if METRICS_FILE:
+        with open(METRICS_FILE, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f'API metrics saved to {METRICS_FILE}\n')
+
+# Organization the engine works on in the current thread (see Organization), the default Organization when not set
+current_organization = contextvars.ContextVar('current_organization', default=None)
+
+def get_organization():
+    return current_organization.get() or default_organization
+
+# Module-level view of an attribute of the current Organization, so that the engine uses the account inventory and caches
+# of the Organization it runs for (e.g. account_inventory.ids() lists the accounts of the current Organization)
+class OrganizationLocal:
+    def __init__(self, attribute):
+        self.attribute = attribute
+
+    def __getattr__(self, name):
+        return getattr(getattr(get_organization(), self.attribute), name)
+
+    def __contains__(self, item):
+        return item in getattr(get_organization(), self.attribute)
+
+# Returns the client of an AWS service in the session of the current Organization, created once and shared by the worker threads
+# Throttling is retried by the SDK in adaptive mode and the connection pool is sized to the number of workers
+def get_client(service_name):
+    organization = get_organization()
+    with organization.lock:
+        if service_name not in organization.clients:
+            organization.clients[service_name] = organization.get_session().client(service_name, config=Config(
+                retries={'mode': 'adaptive', 'total_max_attempts': MAX_ATTEMPTS},
+                max_pool_connections=MAX_WORKERS,
+                connect_timeout=CONNECT_TIMEOUT,
+                read_timeout=READ_TIMEOUT
+            ))
+            api_metrics.register(organization.clients[service_name])
+        return organization.clients[service_name]
+
+# Returns the rate limiter of an Account Management API operation, as each operation has its own TPS quota in each Organization
+def get_rate_limiter(operation):
+    organization = get_organization()
+    with organization.lock:
+        if operation not in organization.rate_limiters:
+            organization.rate_limiters[operation] = RateLimiter(ACCOUNT_API_TPS)
+        return organization.rate_limiters[operation]
+
+# Submits func to a worker pool in a copy of the current context, so that the worker thread runs for the Organization of the caller
+def submit_in_context(executor, func, *args):
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+# ClientError of a BotoCoreError (e.g. a read timeout or connection error left after the retries), with its class name as the error code
+# so that the error can be reported like the API errors
+def as_client_error(e, operation_name):
+    if isinstance(e, ClientError):
+        return e
+    return ClientError({'Error': {'Code': type(e).__name__, 'Message': str(e)}}, operation_name)
+
+# Runs func for every tuple of arguments in items on a bounded worker pool and returns the results in the order of items
+# With return_exceptions, a ClientError (or a BotoCoreError, as a ClientError) is returned in place of the result instead of stopping the run
+def run_concurrently(func, items, return_exceptions=False):
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {submit_in_context(executor, func, *args): index for index, args in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except (ClientError, BotoCoreError) as e:
+                    if not return_exceptions:
+                        raise
+                    results[futures[future]] = as_client_error(e, func.__name__)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    return results
+
+# Runs func for every tuple of arguments in items on a bounded worker pool and yields the results in the order of items
+# Only a few tasks per worker are in flight at a time, so memory does not grow with the number of items
+# A BotoCoreError (e.g. a timeout left after the retries) is raised as a ClientError, like the API errors the callers handle
+def iter_concurrently(func, items):
+    def result(future):
+        try:
+            return future.result()
+        except BotoCoreError as e:
+            raise as_client_error(e, func.__name__) from e
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque()
+        try:
+            for args in items:
+                pending.append(submit_in_context(executor, func, *args))
+                if len(pending) >= MAX_WORKERS * 2:
+                    yield result(pending.popleft())
+            while pending:
+                yield result(pending.popleft())
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+# Calls an Account Management API operation under its rate limiter (the management account must be called without AccountId)
+# Reads are served by the response cache when possible, unless use_cache is False (the reads of the write paths), and refresh it.
+# Writes invalidate the cached reads of the same account and contact type
+def account_api_call(client, operation, account_id, current_account_id, use_cache=True, **kwargs):
+    key = (account_id, operation, kwargs.get('AlternateContactType'))
+    if operation in CACHED_OPERATIONS and use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            api_metrics.record_cache_hit(operation)
+            if cached[2]:
+                raise ClientError(cached[2], ''.join(word.capitalize() for word in operation.split('_')))
+            return cached[1]
+    if account_id != current_account_id:
+        kwargs['AccountId'] = account_id
+    get_rate_limiter(operation).acquire()
     try:
-        list_accounts = boto3.client('organizations').list_accounts()
-        list_of_accounts = list_accounts['Accounts']
-        while 'NextToken' in list_accounts:
-            list_accounts = boto3.client('organizations').list_accounts(NextToken=list_accounts['NextToken'])
-            list_of_accounts += list_accounts['Accounts']
+        resp = getattr(client, operation)(**kwargs)
     except ClientError as e:
-        print(f'\n Could not list AWS accounts... Error: {str(e)}')
-        logging.error(e)
-        exit()
-    for account in list_of_accounts:
-        list_of_accounts_id.append(str(account["Id"]))
-    return list_of_accounts_id
-
-# List all AWS Account IDs in Organizations from specific OU
-def list_ou_accounts_func(ou_id):
-    list_of_accounts_id = []
+        # A contact that is not set is cached too, so that listing unset contacts again makes no call
+        if operation in CACHED_OPERATIONS and e.response['Error']['Code'] == 'ResourceNotFoundException':
+            response_cache.put(key, error={'Error': e.response['Error']})
+        raise
+    finally:
+        if operation in INVALIDATED_OPERATIONS:
+            response_cache.invalidate((account_id, INVALIDATED_OPERATIONS[operation], key[2]))
+    if operation in CACHED_OPERATIONS:
+        response_cache.put(key, {name: value for name, value in resp.items() if name != 'ResponseMetadata'})
+    return resp
+
+# Seconds the Organizations account inventory is cached on disk, 0 disables the cache (override with CONTACTS_MANAGER_CACHE_TTL)
+CACHE_TTL = int(os.environ.get('CONTACTS_MANAGER_CACHE_TTL', '0'))
+
+# Seconds the account tags are cached on disk for tag: selectors, 0 disables the cache (override with CONTACTS_MANAGER_TAG_CACHE_TTL)
+TAG_CACHE_TTL = int(os.environ.get('CONTACTS_MANAGER_TAG_CACHE_TTL', '3600'))
+
+# Seconds the Account Management API reads are cached, 0 disables the cache (override with CONTACTS_MANAGER_RESPONSE_CACHE_TTL)
+RESPONSE_CACHE_TTL = int(os.environ.get('CONTACTS_MANAGER_RESPONSE_CACHE_TTL', '300'))
+
+# Keep the cached reads on disk between runs (override with CONTACTS_MANAGER_RESPONSE_CACHE_DISK)
+RESPONSE_CACHE_DISK = os.environ.get('CONTACTS_MANAGER_RESPONSE_CACHE_DISK', 'false').lower() == 'true'
+
+# Bypass the cached reads, which are still refreshed by the responses (set by --fresh)
+RESPONSE_CACHE_FRESH = False
+
+# Directory of the on-disk caches (override with CONTACTS_MANAGER_CACHE_DIR)
+CACHE_DIR = os.environ.get('CONTACTS_MANAGER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'contacts-manager'))
+
+# Fields of the contacts, the alternate contact fields are in the order of the report columns
+ALTERNATE_CONTACT_FIELDS = ['Name', 'Title', 'EmailAddress', 'PhoneNumber']
+PRIMARY_CONTACT_REQUIRED_FIELDS = ['AddressLine1', 'City', 'CountryCode', 'FullName', 'PhoneNumber', 'PostalCode']
+PRIMARY_CONTACT_OPTIONAL_FIELDS = ['AddressLine2', 'AddressLine3', 'CompanyName', 'DistrictOrCounty', 'StateOrRegion', 'WebsiteUrl']
+
+# Per-account records are named tuples: one small fixed-size object per account or contact, without the nested dicts
+# and the ResponseMetadata of the API responses. A contact that is not set is None, and unset optional fields are None
+Account = namedtuple('Account', ['Id', 'Name', 'Status', 'JoinedTimestamp'])
+AlternateContact = namedtuple('AlternateContact', ALTERNATE_CONTACT_FIELDS)
+PrimaryContact = namedtuple('PrimaryContact', PRIMARY_CONTACT_REQUIRED_FIELDS + PRIMARY_CONTACT_OPTIONAL_FIELDS, defaults=[None] * len(PRIMARY_CONTACT_REQUIRED_FIELDS + PRIMARY_CONTACT_OPTIONAL_FIELDS))
+
+# Builds a record from an API response dict, ignoring the keys that are not fields of the record
+def make_record(record_type, response):
+    return record_type(*(response.get(field) for field in record_type._fields))
+
+# Dict of the fields of a record that are set, the representation of the records in exports (None stays None)
+def record_dict(record):
+    if record is None:
+        return None
+    return {key: value for key, value in record._asdict().items() if value is not None}
+
+# Returns the content of an on-disk cache file if it is younger than ttl seconds, None otherwise
+def read_cache_file(cache_path, ttl):
     try:
-        list_accounts = boto3.client('organizations').list_accounts_for_parent(
-            ParentId=ou_id
-        )
-        list_of_accounts = list_accounts['Accounts']
-        while 'NextToken' in list_accounts:
-            list_accounts = boto3.client('organizations').list_accounts_for_parent(NextToken=list_accounts['NextToken'], ParentId=ou_id)
-            list_of_accounts += list_accounts['Accounts']
-    except ClientError as e:
-        print(f'\n Could not list AWS accounts... Error: {str(e)}')
-        logging.error(e)
-        exit()
-    for account in list_of_accounts:
-        list_of_accounts_id.append(str(account["Id"]))
-    return list_of_accounts_id
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cache['CachedAt'] > ttl:
+        return None
+    return cache
+
+# Writes an on-disk cache file atomically, a cache that cannot be written is only logged
+def write_cache_file(cache_path, cache):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'CachedAt': time.time()} | cache, f)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logging.warning(f'Could not write the cache {cache_path}... Error: {str(e)}')
+
+# Account Management API reads served by the response cache, and the read invalidated by each write
+CACHED_OPERATIONS = ['get_alternate_contact', 'get_contact_information', 'get_primary_email']
+INVALIDATED_OPERATIONS = {
+    'put_alternate_contact': 'get_alternate_contact',
+    'delete_alternate_contact': 'get_alternate_contact',
+    'put_contact_information': 'get_contact_information',
+    'accept_primary_email_update': 'get_primary_email'
+}
+
+# Read-through cache of the Account Management API reads, keyed by (AWS account ID, operation, alternate contact type)
+# Entries are (cached at, response, error response) and expire after ttl seconds. With disk, the entries are loaded from
+# and saved to an on-disk cache file, so they are also shared between runs
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, disk=RESPONSE_CACHE_DISK):
+        self.ttl = ttl
+        self.disk = disk
+        self.entries = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    # Path of the on-disk cache, one file per management account
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, f'responses-{get_account_id()}.json')
+
+    # The lock must be held
+    def load(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.disk and self.ttl > 0:
+                cache = read_cache_file(self.cache_path(), self.ttl)
+                if cache is not None:
+                    self.entries = {tuple(entry['Key']): (entry['CachedAt'], entry['Response'], entry['Error']) for entry in cache['Responses']}
+                atexit.register(contextvars.copy_context().run, self.save)
+        return self.entries
+
+    def get(self, key):
+        if self.ttl <= 0 or RESPONSE_CACHE_FRESH:
+            return None
+        with self.lock:
+            entry = self.load().get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry
+
+    def put(self, key, response=None, error=None):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.load()[key] = (time.time(), response, error)
+            self.changed = True
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.load().pop(key, None) is not None:
+                self.changed = True
+
+    # Saves the entries that have not expired to the on-disk cache
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            now = time.time()
+            responses = [{'Key': list(key), 'CachedAt': entry[0], 'Response': entry[1], 'Error': entry[2]} for key, entry in self.entries.items() if now - entry[0] <= self.ttl]
+            self.changed = False
+        write_cache_file(self.cache_path(), {'Responses': responses})
+
+response_cache = OrganizationLocal('response_cache')
+
+# Organizations account inventory, listed once per session and indexed by AWS account ID
+class AccountInventory:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.accounts = None
+        self.lock = threading.Lock()
+
+    # Path of the on-disk cache, one file per management account
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, f'accounts-{get_account_id()}.json')
+
+    def read_cache(self, cache_path):
+        cache = read_cache_file(cache_path, self.ttl)
+        if cache is None or not isinstance(cache['Accounts'], list):
+            return None
+        return {x: Account(x, name, status, datetime.fromisoformat(joined_timestamp)) for x, name, status, joined_timestamp in cache['Accounts']}
+
+    # Accounts are cached as [Id, Name, Status, JoinedTimestamp] lists
+    def write_cache(self, cache_path, accounts):
+        write_cache_file(cache_path, {'Accounts': [account._replace(JoinedTimestamp=account.JoinedTimestamp.isoformat()) for account in accounts.values()]})
+
+    # Pages list_accounts once and indexes the accounts by ID, using the on-disk cache when enabled
+    def load(self):
+        with self.lock:
+            if self.accounts is not None:
+                return self.accounts
+            cache_path = self.cache_path() if self.ttl > 0 else None
+            accounts = self.read_cache(cache_path) if cache_path else None
+            if accounts is None:
+                accounts = {}
+                try:
+                    paginator = get_client('organizations').get_paginator('list_accounts')
+                    for page in paginator.paginate():
+                        for account in page['Accounts']:
+                            accounts[str(account['Id'])] = Account(str(account['Id']), account['Name'], account['Status'], account['JoinedTimestamp'])
+                except ClientError as e:
+                    print(f'\n Could not list AWS accounts... Error: {str(e)}')
+                    logging.error(e)
+                    exit()
+                if cache_path:
+                    self.write_cache(cache_path, accounts)
+            self.accounts = accounts
+            return self.accounts
+
+    def ids(self):
+        return list(self.load())
+
+    def get(self, account_id):
+        return self.load().get(account_id)
 
-# Captures the AWS Account ID of the logged in account
+    # Looks up an account only if the accounts are already loaded, without listing them (None otherwise)
+    def peek(self, account_id):
+        accounts = self.accounts
+        return accounts.get(account_id) if accounts is not None else None
+
+    def __contains__(self, account_id):
+        return account_id in self.load()
+
+account_inventory = OrganizationLocal('account_inventory')
+
+# List all AWS Account IDs in Organizations
+def list_accounts_func():
+    return account_inventory.ids()
+
+# Organizations hierarchy: the child OUs and the accounts directly in every root and OU
+# Walked breadth-first once per session (the parents of a level are listed concurrently) and cached on disk like the account inventory
+class OrganizationTree:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.tree = None
+        self.lock = threading.Lock()
+
+    # Path of the on-disk cache, one file per management account
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, f'tree-{get_account_id()}.json')
+
+    # Pages the child OUs and the accounts of one root or OU
+    def list_children(self, parent_id):
+        client = get_client('organizations')
+        units = []
+        for page in client.get_paginator('list_organizational_units_for_parent').paginate(ParentId=parent_id):
+            units += [unit['Id'] for unit in page['OrganizationalUnits']]
+        accounts = []
+        for page in client.get_paginator('list_accounts_for_parent').paginate(ParentId=parent_id):
+            accounts += [str(account['Id']) for account in page['Accounts']]
+        return units, accounts
+
+    def load(self):
+        with self.lock:
+            if self.tree is not None:
+                return self.tree
+            cache_path = self.cache_path() if self.ttl > 0 else None
+            tree = read_cache_file(cache_path, self.ttl) if cache_path else None
+            if tree is None:
+                try:
+                    roots = [root['Id'] for root in get_client('organizations').list_roots()['Roots']]
+                    tree = {'Roots': roots, 'Units': {}, 'Accounts': {}}
+                    level = roots
+                    while level:
+                        next_level = []
+                        for parent_id, (units, accounts) in zip(level, run_concurrently(self.list_children, [(x,) for x in level])):
+                            tree['Units'][parent_id] = units
+                            tree['Accounts'][parent_id] = accounts
+                            next_level += units
+                        level = next_level
+                except ClientError as e:
+                    print(f'\n Could not list the Organization tree... Error: {str(e)}')
+                    logging.error(e)
+                    exit()
+                if cache_path:
+                    write_cache_file(cache_path, tree)
+            self.tree = tree
+            return self.tree
+
+    # Accounts of a root or OU, including the accounts of all the OUs nested in it
+    def accounts_under(self, parent_id):
+        tree = self.load()
+        accounts = []
+        parents = [parent_id]
+        while parents:
+            x = parents.pop()
+            accounts += tree['Accounts'][x]
+            parents += reversed(tree['Units'][x])
+        return accounts
+
+    def __contains__(self, parent_id):
+        return parent_id in self.load()['Units']
+
+organization_tree = OrganizationLocal('organization_tree')
+
+# Inverted index of the account tags, tag key -> tag value -> AWS account IDs, built once from the tags of every account of the inventory
+# The tags of all the accounts are listed concurrently and the index is cached on disk for TAG_CACHE_TTL seconds
+class TagIndex:
+    def __init__(self, ttl=TAG_CACHE_TTL):
+        self.ttl = ttl
+        self.index = None
+        self.lock = threading.Lock()
+
+    # Path of the on-disk cache, one file per management account
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, f'tags-{get_account_id()}.json')
+
+    # Pages the tags of one account
+    def list_tags(self, x):
+        tags = []
+        for page in get_client('organizations').get_paginator('list_tags_for_resource').paginate(ResourceId=x):
+            tags += page['Tags']
+        return tags
+
+    def load(self):
+        with self.lock:
+            if self.index is not None:
+                return self.index
+            cache_path = self.cache_path() if self.ttl > 0 else None
+            cache = read_cache_file(cache_path, self.ttl) if cache_path else None
+            if cache is None:
+                accounts = account_inventory.ids()
+                index = {}
+                try:
+                    for x, tags in zip(accounts, run_concurrently(self.list_tags, [(x,) for x in accounts])):
+                        for tag in tags:
+                            index.setdefault(tag['Key'], {}).setdefault(tag['Value'], []).append(x)
+                except ClientError as e:
+                    print(f'\n Could not list the account tags... Error: {str(e)}')
+                    logging.error(e)
+                    exit()
+                cache = {'Tags': index}
+                if cache_path:
+                    write_cache_file(cache_path, cache)
+            self.index = cache['Tags']
+            return self.index
+
+    # Accounts with a tag key, and the given value unless value is None
+    def accounts_with(self, key, value=None):
+        values = self.load().get(key, {})
+        if value is None:
+            return [x for accounts in values.values() for x in accounts]
+        return list(values.get(value, []))
+
+tag_index = OrganizationLocal('tag_index')
+
+# Organizations to aggregate in the report and list commands: comma-separated AWS CLI profiles or ARNs of IAM roles in the management
+# accounts, each optionally named with name= (override with CONTACTS_MANAGER_ORGANIZATIONS or --orgs, e.g. prod=prod-admin,sandbox=arn:aws:iam::111122223333:role/ContactsManager)
+ORGANIZATIONS = os.environ.get('CONTACTS_MANAGER_ORGANIZATIONS', '')
+
+# Session name of the assumed IAM roles
+ASSUME_ROLE_SESSION_NAME = 'contacts-manager'
+
+# Credentials of an IAM role assumed with the default credentials, its temporary credentials are refreshed by botocore before they expire
+class AssumeRoleCredentialProvider(CredentialProvider):
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, role_arn):
+        super().__init__()
+        self.role_arn = role_arn
+        self.sts = boto3.session.Session().client('sts')
+
+    def refresh(self):
+        credentials = self.sts.assume_role(RoleArn=self.role_arn, RoleSessionName=ASSUME_ROLE_SESSION_NAME)['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+
+    def load(self):
+        return RefreshableCredentials.create_from_metadata(self.refresh(), self.refresh, self.METHOD)
+
+# Session of an IAM role, a botocore session whose only credential provider assumes the role
+def assume_role_session(role_arn):
+    botocore_session = botocore.session.get_session()
+    botocore_session.register_component('credential_provider', CredentialResolver([AssumeRoleCredentialProvider(role_arn)]))
+    return boto3.session.Session(botocore_session=botocore_session)
+
+# An AWS Organization: the session of its management account (default credentials, an AWS CLI profile or an assumed IAM role), with its own
+# clients, rate limiters (the Account Management API quotas are per Organization), account inventory, OU tree, tag index and response cache
+class Organization:
+    def __init__(self, name=None, profile=None, role_arn=None):
+        self.name = name
+        self.profile = profile
+        self.role_arn = role_arn
+        self.session = None
+        self.account_id = None
+        self.clients = {}
+        self.rate_limiters = {}
+        self.lock = threading.Lock()
+        self.account_inventory = AccountInventory()
+        self.organization_tree = OrganizationTree()
+        self.tag_index = TagIndex()
+        self.response_cache = ResponseCache()
+
+    # Created on first use, the lock must be held
+    def get_session(self):
+        if self.session is None:
+            if self.role_arn:
+                self.session = assume_role_session(self.role_arn)
+            else:
+                self.session = boto3.session.Session(profile_name=self.profile)
+        return self.session
+
+    # Runs func in a copy of the current context, with this Organization as the current one
+    def run(self, func, *args):
+        return contextvars.copy_context().run(self.enter, func, args)
+
+    def enter(self, func, args):
+        current_organization.set(self)
+        return func(*args)
+
+default_organization = Organization()
+
+# Organizations of a comma-separated list of AWS CLI profiles and IAM role ARNs, each optionally named with name=
+# Unnamed Organizations are named after their profile, or the AWS account ID of their role
+def parse_organizations(organizations):
+    parsed = []
+    for term in organizations.split(','):
+        name, separator, source = term.strip().rpartition('=')
+        if not source.strip():
+            continue
+        name, source = name.strip(), source.strip()
+        if source.startswith('arn:'):
+            parsed.append(Organization(name or source.split(':')[4], role_arn=source))
+        else:
+            parsed.append(Organization(name or source, profile=source))
+    return parsed
+
+# Runs func(*args), which returns an iterable, in every Organization concurrently and yields (Organization, item) as the items come
+# Each Organization is read by its own thread with its own worker pool and rate limiters, so the wall time is the one of the largest Organization
+# The Organizations that fail are printed and added to failed, the items of the other Organizations are still yielded
+def iter_organizations(organizations, failed, func, *args):
+    items = queue.Queue(maxsize=MAX_WORKERS * 2 * len(organizations))
+
+    # Puts (Organization, False, item) for every item, then (Organization, True, error or None)
+    def produce(organization):
+        try:
+            for item in func(*args):
+                items.put((organization, False, item))
+        except BaseException as e:
+            items.put((organization, True, e))
+        else:
+            items.put((organization, True, None))
+
+    for organization in organizations:
+        threading.Thread(target=organization.run, args=(produce, organization), daemon=True).start()
+    running = len(organizations)
+    while running:
+        organization, done, item = items.get()
+        if not done:
+            yield organization, item
+            continue
+        running -= 1
+        if item is not None:
+            print(f'\n Could not read Organization {organization.name}... Error: {str(item)}')
+            logging.error(item)
+            failed.append(organization)
+
+# Prompt of the AWS accounts selector in the interactive menu
+ACCOUNTS_PROMPT = 'AWS account ID(s) (comma-separated AWS account IDs / Organizational unit IDs / root ID / all / tag:key=value, prefix with ! to exclude, e.g. ou-abcd-11111111,tag:env=prod,!123456789012): '
+
+# Resolve a selector expression to AWS account IDs: comma-separated AWS account IDs, Organizational unit IDs (nested OUs included),
+# root IDs or all, each of them can be excluded with a leading ! (e.g. ou-abcd-11111111,ou-abcd-22222222,!123456789012)
+# Tag terms (tag:key=value, or tag:key for any value) narrow the selection: only the accounts with all of them are kept, and tag terms alone
+# select all the accounts with all the tags (e.g. tag:env=prod,tag:team=payments). Only exclusions select all the accounts but the excluded ones
+# Returns None if an OU or root is not in the Organization. With skip_unknown (multi-Organization runs), the AWS account IDs, OUs and roots
+# that are not in the current Organization select nothing instead
+def resolve_selector(selector, skip_unknown=False):
+    included = []
+    excluded = set()
+    tagged = None
+    selected = False
+    for term in selector.split(','):
+        term = term.strip()
+        if not term:
+            continue
+        exclude = term.startswith('!')
+        term = term.lstrip('!').strip()
+        if term.startswith('tag:'):
+            key, separator, value = term[4:].partition('=')
+            accounts = tag_index.accounts_with(key.strip(), value.strip() if separator else None)
+            if not exclude:
+                tagged = set(accounts) if tagged is None else tagged & set(accounts)
+                continue
+        elif term == 'all':
+            accounts = list_accounts_func()
+        elif term[:2] in ('ou', 'r-'):
+            if term in organization_tree:
+                accounts = organization_tree.accounts_under(term)
+            elif skip_unknown:
+                accounts = []
+            else:
+                print(f'\n{term} is not an Organizational unit or root of your Organization.\n')
+                return None
+        else:
+            accounts = [term] if not skip_unknown or term in account_inventory else []
+        if exclude:
+            excluded.update(accounts)
+        else:
+            included += accounts
+            selected = True
+    if not selected and (excluded or tagged is not None):
+        included = list_accounts_func()
+    if tagged is not None:
+        excluded.update(x for x in included if x not in tagged)
+    return [x for x in dict.fromkeys(included) if x not in excluded]
+
+# Captures the AWS Account ID of the logged in account, the management account of the current Organization
 def get_account_id():
-    return boto3.client('sts').get_caller_identity()['Account']
+    organization = get_organization()
+    if organization.account_id is None:
+        organization.account_id = get_client('sts').get_caller_identity()['Account']
+    return organization.account_id
 
 # Validator if the AWS Account ID is valid and is within the Organizations
 def validate_accounts(accounts):
@@ -60,66 +799,438 @@ def validate_accounts(accounts):
         if len(x) != 12:
             print(f'\nAWS account ID {str(x)} is not a valid AWS Account ID.\n')
             return False
+        elif x not in account_inventory:
+            print(f'\nAWS account ID {str(x)} does not belong to your Organization.\n')
+            return False
+    return True
+
+# Normalizes a phone number to its digits and leading +, so that formatting differences are not seen as changes
+def normalize_phone(phone_number):
+    phone_number = phone_number.strip()
+    return ('+' if phone_number.startswith('+') else '') + re.sub(r'\D', '', phone_number)
+
+# Normalizes the fields of a contact (whitespace, email case, phone number format) before comparing them
+def normalize_contact(contact):
+    normalized = {}
+    for key, value in contact.items():
+        value = ' '.join(str(value or '').split())
+        if key == 'PhoneNumber':
+            value = normalize_phone(value)
+        elif key in ('EmailAddress', 'WebsiteUrl'):
+            value = value.lower()
+        elif key == 'CountryCode':
+            value = value.upper()
+        normalized[key] = value
+    return normalized
+
+# Compares the current contact record with the desired contact dict, a missing contact always differs
+def contact_differs(current, desired):
+    if current is None:
+        return True
+    current = normalize_contact(record_dict(current))
+    desired = normalize_contact(desired)
+    return any(current.get(key, '') != desired.get(key, '') for key in current.keys() | desired.keys())
+
+# Reads the current contact of every item concurrently from AWS, bypassing the response cache: the plans of the writes and the
+# before-images of the journal must not rely on a contact read earlier in the session, which may have been changed since
+def read_current_contacts(get_func, items):
+    def read_current(*item):
+        return get_func(*item, use_cache=False)
+
+    return run_concurrently(read_current, items, return_exceptions=True)
+
+# Reads the current contact of every item concurrently and splits the items into changed, unchanged and failed
+# desired is the contact wanted for all the items, or a list with the contact wanted for each item
+# The current contacts are kept in Before by contact key, as the before-images of the journal
+def plan_updates(get_func, items, desired):
+    plan = {'Changed': [], 'Unchanged': [], 'Failed': [], 'Before': {}}
+    results = read_current_contacts(get_func, items)
+    desired_items = desired if isinstance(desired, list) else [desired] * len(items)
+    for item, current, desired_item in zip(items, results, desired_items):
+        if isinstance(current, ClientError):
+            plan['Failed'].append((item, current))
+            continue
+        plan['Before'][contact_key(item)] = current
+        if contact_differs(current, desired_item):
+            plan['Changed'].append(item)
         else:
-            aws_org_accounts = list_accounts_func()
-            if x not in aws_org_accounts:
-                print(f'\nAWS account ID {str(x)} does not belong to your Organization.\n')
-                return False
-            else:
-                return True
+            plan['Unchanged'].append(item)
+    return plan
+
+# Prints the plan summary, items are the (client, account, current account, [contact type]) arguments of the API helpers
+def print_plan(plan):
+    print(f'\nPlan: {len(plan["Changed"])} to update, {len(plan["Unchanged"])} unchanged, {len(plan["Failed"])} failed to read\n')
+    for item in plan['Changed']:
+        print(f'  ~ {" ".join(item[1:2] + item[3:4])}')
+    for item, e in plan['Failed']:
+        print(f'  ✗ {" ".join(item[1:2] + item[3:4])}: {e.response["Error"]["Message"]}')
+    print('')
 
-# List the alternate contact(s)
-def alternate_contact_list_func(accounts, current_account_id, menu_entry_2_list):
-    resp = {'AlternateContact': {}}
-    client = boto3.client('account')
+# Directory of the write-ahead journals of the bulk writes, one JSON lines file per job (override with CONTACTS_MANAGER_JOURNAL_DIR)
+JOURNAL_DIR = os.environ.get('CONTACTS_MANAGER_JOURNAL_DIR', 'aws-contacts-journal')
+
+# Outcomes that complete a journal entry, a rerun of the same job skips these contacts
+JOURNAL_COMPLETED = {'DONE', 'UNCHANGED'}
+
+# Key of a contact from the arguments of the get, put and delete API helpers: (account, alternate contact type or primary)
+def contact_key(item):
+    return (item[1], item[3].lower() if len(item) > 3 and isinstance(item[3], str) else 'primary')
+
+# Append-only journal of a bulk write job. The before-image and the intended value of every contact are written and synced to disk
+# before any API call, then the outcome of every contact is appended as soon as its call returns. The journal of a job is found
+# again from its operation and parameters, so a rerun of an interrupted or failed job only redoes the contacts that did not complete
+# Once all the contacts of a job completed, running the same job again starts a new journal
+class Journal:
+    def __init__(self, operation=None, job=None, path=None):
+        self.operation = operation
+        self.entries = {}
+        self.file = None
+        self.lock = threading.Lock()
+        if path is None:
+            job_id = hashlib.blake2b(json.dumps([operation, job], sort_keys=True, default=str).encode('UTF-8'), digest_size=8).hexdigest()
+            prefix = f'{operation}-{job_id}-'
+            journals = sorted(name for name in os.listdir(JOURNAL_DIR) if name.startswith(prefix)) if os.path.isdir(JOURNAL_DIR) else []
+            if journals:
+                path = os.path.join(JOURNAL_DIR, journals[-1])
+                self.load(path)
+            if not journals or self.finished():
+                self.entries = {}
+                path = os.path.join(JOURNAL_DIR, f'{prefix}{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}.jsonl')
+        else:
+            self.load(path)
+        self.path = path
 
-    for x in accounts:
-        alternate_contact_type = {}
-        for y in menu_entry_2_list:
-            print(f'Getting {y} alternate contact for {x}...')
-            try:
-                if x == current_account_id:
-                    resp_alternate_contact = client.get_alternate_contact(AlternateContactType=y.upper())
-                else:
-                    resp_alternate_contact = client.get_alternate_contact(AccountId=str(x), AlternateContactType=y.upper())
-                resp_alternate_contact['AlternateContact'].pop('AlternateContactType')
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                    resp_alternate_contact = {}
-                    resp_alternate_contact['AlternateContact'] = 'Null'
-                else:
-                    print('\n')
-                    logging.error(e)
-                    return False
-            alternate_contact_type[y] = resp_alternate_contact['AlternateContact']
-        resp['AlternateContact'][x] = alternate_contact_type
+    def load(self, path):
+        with open(path, encoding='UTF-8') as f:
+            for line in f:
+                try:
+                    self.apply(json.loads(line))
+                except ValueError:
+                    # The last line of a journal interrupted while writing
+                    continue
+
+    def finished(self):
+        return all(entry['Status'] in JOURNAL_COMPLETED for entry in self.entries.values())
+
+    # Entries are {'Intent', 'Before', 'After', 'Status', 'Error'} by contact key, the first before-image of a contact is kept across reruns
+    def apply(self, record):
+        if record['Event'] == 'job':
+            self.operation = record['Operation']
+            return
+        entry = self.entries.setdefault((record['AccountId'], record['ContactType']), {'Intent': False, 'Before': None, 'After': None, 'Status': None, 'Error': ''})
+        if record['Event'] == 'intent':
+            if not entry['Intent']:
+                entry['Before'] = record['Before']
+            entry['Intent'] = True
+            entry['After'] = record['After']
+        else:
+            entry['Status'] = record['Status']
+            entry['Error'] = record.get('Error', '')
+
+    def write(self, records, sync=False):
+        if not records:
+            return
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                new = not os.path.exists(self.path)
+                self.file = open(self.path, 'a', encoding='UTF-8')
+                if new:
+                    self.file.write(json.dumps({'Event': 'job', 'Operation': self.operation, 'At': datetime.now().isoformat(timespec='seconds')}) + '\n')
+            at = datetime.now().isoformat(timespec='seconds')
+            for record in records:
+                self.file.write(json.dumps(record | {'At': at}, default=str) + '\n')
+                self.apply(record)
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def completed(self, key):
+        return key in self.entries and self.entries[key]['Status'] in JOURNAL_COMPLETED
+
+    # before is the current record of the contact (None if not set), after the contact to write (None to delete it)
+    def write_intents(self, intents):
+        self.write([{'Event': 'intent', 'AccountId': x, 'ContactType': y, 'Before': record_dict(before), 'After': after} for (x, y), before, after in intents], sync=True)
+
+    def write_outcomes(self, keys, status, error=''):
+        self.write([{'Event': 'outcome', 'AccountId': x, 'ContactType': y, 'Status': status, 'Error': error} for x, y in keys])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+# Calls func(*args) for the contact key of a journal and appends its outcome (statuses of success and failure) to the journal
+def journaled_call(journal, key, statuses, func, *args):
+    try:
+        result = func(*args)
+    except (ClientError, BotoCoreError) as e:
+        journal.write_outcomes([key], statuses[1], as_client_error(e, func.__name__).response['Error']['Message'])
+        raise
+    journal.write_outcomes([key], statuses[0])
+    return result
+
+# Runs the writes of a bulk job through its journal, writes are (contact key, before, after, func, args)
+# The intents of all the writes are journaled first, then the calls run concurrently. Returns the result of every write (None or the ClientError)
+def run_journaled(journal, writes):
+    if not writes:
+        return []
+    journal.write_intents([(key, before, after) for key, before, after, _, _ in writes])
+    return run_concurrently(journaled_call, [(journal, key, ('DONE', 'FAILED'), func) + args for key, _, _, func, args in writes], return_exceptions=True)
+
+# Items of a job that are not completed in its journal
+def pending_items(journal, items):
+    pending = [item for item in items if not journal.completed(contact_key(item))]
+    if len(pending) < len(items):
+        print(f'{len(items) - len(pending)} contact(s) completed by a previous run of this job are skipped (journal {journal.path})\n')
+    return pending
+
+# Prints the outcome of the writes of a journal, returns True if none of them failed
+def report_journal(journal, results):
+    failed = sum(isinstance(result, ClientError) for result in results)
+    journal.close()
+    if results:
+        print(f"\n{len(results) - failed} contact(s) {'deleted' if journal.operation.endswith('-delete') else 'written'}, {failed} failed. Journal saved to {journal.path}")
+        if failed:
+            print('Run the same job again to retry the failed contacts only.')
+        print(f'Roll it back with: python3 script.py rollback {journal.path}')
+    return failed == 0
+
+# True if the current record of a contact (None if not set) holds the contact of a journal image (None if not set)
+def contact_matches(current, image):
+    if current is None or image is None:
+        return current is None and image is None
+    return not contact_differs(current, image)
+
+# Short description of a contact of a journal image, for the rollback plan
+def describe_contact(image):
+    return (image or {}).get('EmailAddress') or (image or {}).get('FullName') or 'not set'
+
+# Roll back the job of a journal: the before-images of the contacts it wrote (or may have written, if it was interrupted) are restored
+# concurrently, alternate contacts that were not set are deleted. Restored contacts are journaled too, so a rollback can be run again
+# The current contacts are read first (from AWS, not the response cache): only the contacts that still hold the value written by the job
+# are restored, the ones changed since then are conflicts, left as they are unless force. Contacts already back to their before-image are skipped
+def rollback_journal(path, current_account_id, assume_yes=False, force=False):
+    if not os.path.exists(path):
+        print(f'\nThe journal {path} does not exist.')
+        return False
+    client = get_client('account')
+    journal = Journal(path=path)
+    entries = [(key, entry) for key, entry in journal.entries.items() if entry['Intent'] and entry['Status'] not in ('FAILED', 'ROLLED_BACK')]
+
+    def get_contact(client, x, current_account_id, y, use_cache=True):
+        if y == 'primary':
+            return get_contact_information(client, x, current_account_id, use_cache)
+        return get_alternate_contact(client, x, current_account_id, y.capitalize(), use_cache)
+
+    currents = read_current_contacts(get_contact, [(client, x, current_account_id, y) for (x, y), _ in entries])
+    restores, conflicts, unreadable, restored = [], [], [], []
+    for ((x, y), entry), current in zip(entries, currents):
+        if isinstance(current, ClientError):
+            unreadable.append(((x, y), current))
+        elif contact_matches(current, entry['After']) or (force and not contact_matches(current, entry['Before'])):
+            restores.append(((x, y), entry))
+        elif contact_matches(current, entry['Before']):
+            restored.append((x, y))
+        else:
+            conflicts.append(((x, y), record_dict(current)))
+    journal.write_outcomes(restored, 'ROLLED_BACK')
+
+    print(f'\nRollback of {journal.operation} ({path}): {len(restores)} contact(s) to restore, {len(restored)} already restored, {len(conflicts)} changed since the job, {len(unreadable)} failed to read\n')
+    for (x, y), entry in restores:
+        print(f'  ↺ {x} {y}: {describe_contact(entry["Before"])}')
+    for (x, y), current in conflicts:
+        print(f'  ! {x} {y}: changed since the job (now {describe_contact(current)}), left as it is')
+    for (x, y), e in unreadable:
+        print(f'  ✗ {x} {y}: {e.response["Error"]["Message"]}')
+    print('')
+    if conflicts:
+        print('Run the rollback with --force to restore the contacts changed since the job too.\n')
+    if not restores:
+        journal.close()
+        return not conflicts and not unreadable
+    if not assume_yes and input(f'Restore {len(restores)} contact(s)? (y/N): ').lower() != 'y':
+        journal.close()
+        print('\nNothing was restored.')
+        return False
+
+    writes = []
+    for (x, y), entry in restores:
+        before = entry['Before']
+        if y == 'primary':
+            writes.append(((x, y), put_contact_information, (client, x, current_account_id, before)))
+        elif before is None:
+            writes.append(((x, y), delete_alternate_contact, (client, x, current_account_id, y.capitalize())))
+        else:
+            writes.append(((x, y), put_alternate_contact, (client, x, current_account_id, y.capitalize(), before['EmailAddress'], before['Name'], before['PhoneNumber'], before['Title'])))
+    results = run_concurrently(journaled_call, [(journal, key, ('ROLLED_BACK', 'ROLLBACK_FAILED'), func) + args for key, func, args in writes], return_exceptions=True)
+    journal.close()
+
+    failed = [(key, result) for (key, _, _), result in zip(writes, results) if isinstance(result, ClientError)]
+    for (x, y), e in failed:
+        print(f'  ✗ {x} {y}: {e.response["Error"]["Message"]}')
+    print(f'\n{len(writes) - len(failed)} contact(s) restored, {len(failed)} failed (run the rollback again to retry them).')
+    return not failed and not conflicts and not unreadable
+
+# List exporters receive one record per account as soon as it is fetched, so the whole list is never held in memory
+# Local files are gzip-compressed JSON lines, readable with zcat or as a gzip NDJSON table by Athena
+class NdjsonFileExporter:
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='UTF-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=str) + '\n')
+
+    def close(self):
+        self.file.close()
+        print(f'\nResult saved to {self.path}')
+
+    # The lines already written are kept
+    def abort(self):
+        self.file.close()
+
+# S3 objects are gzip-compressed JSON lines streamed with a multipart upload, one part every part_size bytes of compressed data
+class NdjsonS3Exporter:
+    part_size = 8 * 1024 * 1024
+
+    def __init__(self, bucket, key):
+        self.client = get_client('s3')
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = self.client.create_multipart_upload(Bucket=bucket, Key=key, ContentType='application/x-ndjson', ContentEncoding='gzip')['UploadId']
+        self.compressor = zlib.compressobj(wbits=31)
+        self.buffer = bytearray()
+        self.parts = []
+
+    def write(self, record):
+        self.buffer += self.compressor.compress((json.dumps(record, default=str) + '\n').encode('UTF-8'))
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        part_number = len(self.parts) + 1
+        resp = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=bytes(self.buffer))
+        self.parts.append({'ETag': resp['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    # The last part can be smaller than the 5 MiB minimum of the other parts
+    def close(self):
+        self.buffer += self.compressor.flush()
+        self.upload_part()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+        print(f'\nResult saved to s3://{self.bucket}/{self.key}')
+
+    def abort(self):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except ClientError as e:
+            logging.error(e)
+
+# Prints every record as it is fetched
+class TerminalExporter:
+    def __init__(self):
+        print('\nReturn: \n')
 
+    def write(self, record):
+        pprint(record)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+# Ask where to export a list to, the object or file name starts with list_name
+def open_exporter(list_name):
+    file_name = f'{list_name}_{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.jsonl.gz'
     export_to_s3 = input('\nDo you want to export the result to an S3 bucket? (y/N): ')
     if export_to_s3.lower() in ['y', 'yes']:
         s3_bucket_name = input('S3 bucket name: ')
-        s3_object_name = 'alternate-contact-list_' + \
-            datetime.now().strftime("%d-%m-%Y_%H-%M-%S") + '.json'
-        s3_client = boto3.client('s3')
         try:
-            s3_client.put_object(
-                Body=bytes(json.dumps(resp).encode('UTF-8')),
-                Bucket=s3_bucket_name,
-                Key=s3_object_name
-            )
+            return NdjsonS3Exporter(s3_bucket_name, file_name)
         except ClientError as e:
             print('\n')
             logging.error(e)
             print(e)
-            return False
-        return True
+            return None
+    export_to_file = input('Do you want to export the result to a local file? (y/N): ')
+    if export_to_file.lower() in ['y', 'yes']:
+        return NdjsonFileExporter(file_name)
+    return TerminalExporter()
+
+# Export destination of a headless list: s3://bucket/key, a local file or the terminal
+def output_exporter(output):
+    if not output:
+        return TerminalExporter()
+    elif output.startswith('s3://'):
+        bucket, _, key = output[5:].partition('/')
+        return NdjsonS3Exporter(bucket, key)
     else:
-        print('\nReturn: \n')
-        pprint(resp['AlternateContact'])
-        return True
+        return NdjsonFileExporter(output)
+
+# Streams the records of a list to the given export destination, or to the one chosen interactively
+# With organizations, the records are of several Organizations and name theirs (see organizations_list_func)
+def export_list(list_name, records, exporter=None, organizations=None):
+    if exporter is None:
+        exporter = open_exporter(list_name)
+    if exporter is None:
+        return False
+    contact_index = ContactIndexWriter(organizations)
+    try:
+        for record in records:
+            exporter.write(record)
+            contact_index.write_record(record)
+        exporter.close()
+    except ClientError as e:
+        exporter.abort()
+        print('\n')
+        logging.error(e)
+        return False
+    finally:
+        contact_index.close()
+    return True
+
+# Get one alternate contact record of an AWS account, None if not set
+def get_alternate_contact(client, x, current_account_id, y, use_cache=True):
+    print(f'Getting {y} alternate contact for {x}...')
+    try:
+        resp_alternate_contact = account_api_call(client, 'get_alternate_contact', x, current_account_id, use_cache=use_cache, AlternateContactType=y.upper())
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+    return make_record(AlternateContact, resp_alternate_contact['AlternateContact'])
+
+# Alternate contact list records, the results come in the order of the items, so the contact types of an account are consecutive
+def alternate_contact_records(accounts, current_account_id, menu_entry_2_list):
+    client = get_client('account')
+    results = iter_concurrently(get_alternate_contact, ((client, x, current_account_id, y) for x in accounts for y in menu_entry_2_list))
+    for x in accounts:
+        yield {'AccountId': x, 'AlternateContact': {y: record_dict(next(results)) for y in menu_entry_2_list}}
+
+# List the alternate contact(s)
+def alternate_contact_list_func(accounts, current_account_id, menu_entry_2_list, exporter=None):
+    return export_list('alternate-contact-list', alternate_contact_records(accounts, current_account_id, menu_entry_2_list), exporter)
+
+# Update one alternate contact of an AWS account
+def put_alternate_contact(client, x, current_account_id, y, email_address, name, phone_number, title):
+    print(f'Updating {y} alternate contact for AWS account {x}...')
+    try:
+        account_api_call(
+            client, 'put_alternate_contact', x, current_account_id,
+            AlternateContactType=y.upper(),
+            EmailAddress=email_address,
+            Name=name,
+            PhoneNumber=phone_number,
+            Title=title
+        )
+    except ClientError as e:
+        print(f'\n Could not update {y} alternate contact for AWS account {x}... Error: {str(e)}')
+        raise
 
 # Update the alternate contact(s)
 def alternate_contact_update_func(accounts, current_account_id, menu_entry_2_list):
-    client = boto3.client('account')
+    client = get_client('account')
 
     email_address = input(f'Type the email address (E.g. {menu_entry_2_list[0].lower()}.team@email.com): ')
     name = input(f'Type the name (E.g. {menu_entry_2_list[0].capitalize() } Team): ')
@@ -127,117 +1238,126 @@ def alternate_contact_update_func(accounts, current_account_id, menu_entry_2_lis
     title = input(f'Type the title (E.g. {menu_entry_2_list[0].capitalize()} Internal Team): ')
     print('')
 
-    for x in accounts:
-        for y in menu_entry_2_list:
-            print(f'Updating {y} alternate contact for AWS account {x}...')
-            if current_account_id == x:
-                try:
-                    client.put_alternate_contact(
-                        AlternateContactType=y.upper(),
-                        EmailAddress=email_address,
-                        Name=name,
-                        PhoneNumber=phone_number,
-                        Title=title
-                    )
-                except ClientError as e:
-                    print(f'\n Could not update {y} alternate contact for AWS account {x}... Error: {str(e)}')
-                    logging.error(e)
-                    return False
-            else:
-                try:
-                    client.put_alternate_contact(
-                        AccountId=x,
-                        AlternateContactType=y.upper(),
-                        EmailAddress=email_address,
-                        Name=name,
-                        PhoneNumber=phone_number,
-                        Title=title
-                    )
-                except ClientError as e:
-                    print(f'\n Could not update {y} alternate contact for AWS account {x}... Error: {str(e)}')
-                    logging.error(e)
-                    return False
-    return True
+    # The current contacts are always read, as the before-images of the journal
+    contact = {'EmailAddress': email_address, 'Name': name, 'PhoneNumber': phone_number, 'Title': title}
+    journal = Journal('alternate-update', [accounts, menu_entry_2_list, contact])
+    items = pending_items(journal, [(client, x, current_account_id, y) for x in accounts for y in menu_entry_2_list])
+    plan = plan_updates(get_alternate_contact, items, contact)
+    print_plan(plan)
+    journal.write_outcomes([contact_key(item) for item, _ in plan['Failed']], 'FAILED')
+    items = plan['Changed']
+    if DIFF_MODE:
+        journal.write_outcomes([contact_key(item) for item in plan['Unchanged']], 'UNCHANGED')
+    else:
+        items += plan['Unchanged']
 
-# Delete the alternate contact(s)
-def alternate_contact_delete_func(accounts, current_account_id, menu_entry_2_list):
-    client = boto3.client('account')
+    results = run_journaled(journal, [(contact_key(item), plan['Before'][contact_key(item)], contact, put_alternate_contact, item + (email_address, name, phone_number, title)) for item in items])
+    return report_journal(journal, results) and not plan['Failed']
 
-    for x in accounts:
-        for y in menu_entry_2_list:
-            print(f'Deleting {y} alternate contact for {x}...')
-            if current_account_id == x:
-                try:
-                    client.delete_alternate_contact(
-                        AlternateContactType=y.upper()
-                    )
-                except ClientError as e:
-                    if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                        pass
-                    else:
-                        print(f'\n Could not delete {y} alternate contact for AWS account {x}... Error: {str(e)}')
-                        logging.error(e)
-                        return False
-            else:
-                try:
-                    client.delete_alternate_contact(
-                        AccountId=x,
-                        AlternateContactType=y.upper()
-                    )
-                except ClientError as e:
-                    if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                        pass
-                    else:
-                        print(f'\n Could not delete {y} alternate contact for AWS account {x}... Error: {str(e)}')
-                        logging.error(e)
-                        return False
-    return True
+# Delete one alternate contact of an AWS account, ignoring contacts that are not set
+def delete_alternate_contact(client, x, current_account_id, y):
+    print(f'Deleting {y} alternate contact for {x}...')
+    try:
+        account_api_call(client, 'delete_alternate_contact', x, current_account_id, AlternateContactType=y.upper())
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            pass
+        else:
+            print(f'\n Could not delete {y} alternate contact for AWS account {x}... Error: {str(e)}')
+            raise
+
+# Columns of the delete results file
+DELETE_RESULTS_COLUMNS = ['Account ID', 'Contact Type', 'Status', 'Deleted Contact Email', 'Error']
+
+# Delete the alternate contact(s): the current contacts are read concurrently first, so only the contacts that are set are deleted
+# after a single confirmation (skipped with assume_yes), then all the deletes run in parallel under the rate limiter
+def alternate_contact_delete_func(accounts, current_account_id, menu_entry_2_list, dry_run=False, assume_yes=False, results_path=None):
+    client = get_client('account')
+
+    journal = Journal('alternate-delete', [accounts, menu_entry_2_list])
+    items = [(client, x, current_account_id, y) for x in accounts for y in menu_entry_2_list]
+    status = {(item[1], item[3]): ('Already deleted', '', '') for item in items if journal.completed(contact_key(item))}
+    items = pending_items(journal, items)
+    before = {}
+    plan = []
+    for item, current in zip(items, read_current_contacts(get_alternate_contact, items)):
+        if isinstance(current, ClientError):
+            status[(item[1], item[3])] = ('Failed', '', current.response['Error']['Message'])
+        elif current is None:
+            status[(item[1], item[3])] = ('Not set', '', '')
+        else:
+            status[(item[1], item[3])] = ('Would delete', current.EmailAddress, '')
+            before[contact_key(item)] = current
+            plan.append(item)
 
-# List the primary contact information
-def primary_contact_list_func(accounts, current_account_id):
-    resp = {'PrimaryContactInformation': {}}
-    client = boto3.client('account')
+    print(f'\nPlan: {len(plan)} to delete, {sum(result[0] == "Not set" for result in status.values())} not set, {sum(result[0] == "Failed" for result in status.values())} failed to read\n')
+    for item in plan:
+        print(f'  - {item[1]} {item[3]} ({status[(item[1], item[3])][1]})')
+    print('')
 
-    for x in accounts:
-        print(f'Getting primary contact information for AWS account {x}...')
-        try:
-            if x == current_account_id:
-                resp_primary_contact_info = client.get_contact_information()
+    if plan and not dry_run:
+        if not assume_yes and input(f'Delete {len(plan)} alternate contact(s) from {len({item[1] for item in plan})} AWS account(s)? (y/N): ').lower() != 'y':
+            print('\nNothing was deleted.')
+            return False
+        contact_index = ContactIndexWriter()
+        journal.write_outcomes([(x, y.lower()) for (x, y), result in status.items() if result[0] == 'Failed'], 'FAILED')
+        results = run_journaled(journal, [(contact_key(item), before[contact_key(item)], None, delete_alternate_contact, item) for item in plan])
+        for item, result in zip(plan, results):
+            if isinstance(result, ClientError):
+                status[(item[1], item[3])] = ('Failed', status[(item[1], item[3])][1], result.response['Error']['Message'])
             else:
-                resp_primary_contact_info = client.get_contact_information(AccountId=x)
-        except ClientError as e:
-            print(f'\n Could not list primary contact information for AWS account {x}... Error: {str(e)}')
-            logging.error(e)
-            exit()
-        primary_contact_information = resp_primary_contact_info['ContactInformation']
-        resp['PrimaryContactInformation'][x] = primary_contact_information
+                status[(item[1], item[3])] = ('Deleted', status[(item[1], item[3])][1], '')
+                contact_index.delete(item[1], item[3].upper())
+        contact_index.close()
+        report_journal(journal, results)
+
+    # Per-account results
+    results = [[x, y] + list(status[(x, y)]) for x in accounts for y in menu_entry_2_list]
+    for index, x in enumerate(accounts):
+        account_results = results[index * len(menu_entry_2_list):(index + 1) * len(menu_entry_2_list)]
+        print(f'{x}: ' + ', '.join(f'{result[1]} {result[2].lower()}' + (f' ({result[4]})' if result[4] else '') for result in account_results))
+
+    if results_path:
+        with open(results_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(DELETE_RESULTS_COLUMNS)
+            writer.writerows(results)
+        print(f'\nResults saved to {results_path}')
+
+    return all(result[2] != 'Failed' for result in results)
+
+# Get the primary contact information record of an AWS account
+def get_contact_information(client, x, current_account_id, use_cache=True):
+    print(f'Getting primary contact information for AWS account {x}...')
+    try:
+        resp_primary_contact_info = account_api_call(client, 'get_contact_information', x, current_account_id, use_cache=use_cache)
+    except ClientError as e:
+        print(f'\n Could not list primary contact information for AWS account {x}... Error: {str(e)}')
+        raise
+    return make_record(PrimaryContact, resp_primary_contact_info['ContactInformation'])
 
-    export_to_s3 = input('\nDo you want to export the result to an S3 bucket? (y/N): ')
-    if export_to_s3.lower() in ['y', 'yes']:
-        s3_bucket_name = input('S3 bucket name: ')
-        s3_object_name = 'primary-contat-information-list_' + \
-            datetime.now().strftime("%d-%m-%Y_%H-%M-%S") + '.json'
-        s3_client = boto3.client('s3')
-        try:
-            s3_client.put_object(
-                Body=bytes(json.dumps(resp).encode('UTF-8')),
-                Bucket=s3_bucket_name,
-                Key=s3_object_name
-            )
-        except ClientError as e:
-            print('\n')
-            logging.error(e)
-            print(e)
-            return False
-        return True
-    else:
-        print('\nReturn: \n')
-        pprint(resp['PrimaryContactInformation'])
-        return True
+# Primary contact information list records
+def primary_contact_records(accounts, current_account_id):
+    client = get_client('account')
+    results = iter_concurrently(get_contact_information, ((client, x, current_account_id) for x in accounts))
+    return ({'AccountId': x, 'PrimaryContactInformation': record_dict(y)} for x, y in zip(accounts, results))
+
+# List the primary contact information
+def primary_contact_list_func(accounts, current_account_id, exporter=None):
+    return export_list('primary-contact-information-list', primary_contact_records(accounts, current_account_id), exporter)
+
+# Update the primary contact information of an AWS account
+def put_contact_information(client, x, current_account_id, contact_information):
+    print(f'Updating primary contact information for AWS account {x}...')
+    try:
+        account_api_call(client, 'put_contact_information', x, current_account_id, ContactInformation=contact_information)
+    except ClientError as e:
+        print(f'\n Could not update primary contact information for AWS account {x}... Error: {str(e)}')
+        raise
 
 # Update the primary contact information
 def primary_contact_update_func(accounts, current_account_id):
-    client = boto3.client('account')
+    client = get_client('account')
 
     required_input = ['AddressLine1', 'City', 'FullName', 'PhoneNumber', 'PostalCode']
     optional_input = ['AddressLine2', 'AddressLine3', 'CompanyName', 'DistrictOrCounty', 'StateOrRegion', 'WebsiteUrl']
@@ -293,77 +1413,68 @@ def primary_contact_update_func(accounts, current_account_id):
         else:
             print('\nSome of the required fields were left empty, please fill in the fields again.\n')
 
-    for x in accounts:
-        print(f'Updating primary contact information for AWS account {x}...')
-        if current_account_id == x:
-            try:
-                client.put_contact_information(
-                    ContactInformation=contact_information
-                )
-            except ClientError as e:
-                print(f'\n Could not update primary contact information for AWS account {x}... Error: {str(e)}')
-                logging.error(e)
-                return False
-        else:
-            try:
-                client.put_contact_information(
-                    AccountId=x,
-                    ContactInformation=contact_information
-                )
-            except ClientError as e:
-                print(f'\n Could not update primary contact information for account {x}... Error: {str(e)}')
-                logging.error(e)
-                return False
-    return True
+    # The current contacts are always read, as the before-images of the journal
+    journal = Journal('primary-update', [accounts, contact_information])
+    items = pending_items(journal, [(client, x, current_account_id) for x in accounts])
+    plan = plan_updates(get_contact_information, items, contact_information)
+    print_plan(plan)
+    journal.write_outcomes([contact_key(item) for item, _ in plan['Failed']], 'FAILED')
+    items = plan['Changed']
+    if DIFF_MODE:
+        journal.write_outcomes([contact_key(item) for item in plan['Unchanged']], 'UNCHANGED')
+    else:
+        items += plan['Unchanged']
 
-# List the root email
-def root_email_list_func(accounts, current_account_id):
-    resp = {'RootEmailAddresses': {}}
-    client = boto3.client('account')
+    results = run_journaled(journal, [(contact_key(item), plan['Before'][contact_key(item)], contact_information, put_contact_information, item + (contact_information,)) for item in items])
+    return report_journal(journal, results) and not plan['Failed']
 
-    for x in accounts:
-        print(f'Getting root email address for AWS account {x}...')
-        try:
-            if x == current_account_id:
-                resp_root_email = {'PrimaryEmail': 'management account - not available'}
-            else:
-                resp_root_email = client.get_primary_email(AccountId=x)
-        except ClientError as e:
-            print(f'\n Could not list root email address for AWS account {x}... Error: {str(e)}')
-            logging.error(e)
-            exit()
-        root_email_information = resp_root_email['PrimaryEmail']
-        resp['RootEmailAddresses'][x] = root_email_information
+# Get the root email address of an AWS account (not available for the management account)
+def get_primary_email(client, x, current_account_id):
+    print(f'Getting root email address for AWS account {x}...')
+    if x == current_account_id:
+        return 'management account - not available'
+    try:
+        resp_root_email = account_api_call(client, 'get_primary_email', x, current_account_id)
+    except ClientError as e:
+        print(f'\n Could not list root email address for AWS account {x}... Error: {str(e)}')
+        raise
+    return resp_root_email['PrimaryEmail']
 
-    export_to_s3 = input('\nDo you want to export the result to an S3 bucket? (y/N): ')
-    if export_to_s3.lower() in ['y', 'yes']:
-        s3_bucket_name = input('S3 bucket name: ')
-        s3_object_name = 'root-email-address-list_' + \
-            datetime.now().strftime("%d-%m-%Y_%H-%M-%S") + '.json'
-        s3_client = boto3.client('s3')
-        try:
-            s3_client.put_object(
-                Body=bytes(json.dumps(resp).encode('UTF-8')),
-                Bucket=s3_bucket_name,
-                Key=s3_object_name
-            )
-        except ClientError as e:
-            print('\n')
-            logging.error(e)
-            print(e)
-            return False
-        return True
-    else:
-        print('\nReturn: \n')
-        pprint(resp['RootEmailAddresses'])
-        return True
+# Root email address list records
+def root_email_records(accounts, current_account_id):
+    client = get_client('account')
+    results = iter_concurrently(get_primary_email, ((client, x, current_account_id) for x in accounts))
+    return ({'AccountId': x, 'RootEmailAddress': y} for x, y in zip(accounts, results))
+
+# List the root email
+def root_email_list_func(accounts, current_account_id, exporter=None):
+    return export_list('root-email-address-list', root_email_records(accounts, current_account_id), exporter)
+
+# List the contacts of the accounts of several Organizations to one export, every record with the name of its Organization
+# The target is resolved in every Organization, the AWS account IDs, OUs and roots of the other Organizations select nothing
+def organizations_list_func(organizations, contact, target, menu_entry_2_list, exporter):
+    def records():
+        accounts = resolve_selector(target, skip_unknown=True)
+        if contact == 'alternate':
+            return alternate_contact_records(accounts, get_account_id(), menu_entry_2_list)
+        elif contact == 'primary':
+            return primary_contact_records(accounts, get_account_id())
+        return root_email_records(accounts, get_account_id())
+
+    failed = []
+    resp = export_list(f'{contact}-contact-list', ({'Organization': organization.name} | record for organization, record in iter_organizations(organizations, failed, records)), exporter, organizations)
+    return resp and not failed
+
+# Valid root email address
+EMAIL_REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
 
 # Update the root email(s)
 def root_email_update_func(accounts, current_account_id):
-    client = boto3.client('account')
+    from simple_term_menu import TerminalMenu
+    client = get_client('account')
     change_status = ['⟳'] * len(accounts)
     accounts.sort()
-    regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
+    regex = EMAIL_REGEX
     green = '\033[92m'
     cyan = '\033[96m'
     italic = '\033[0;3m'
@@ -438,6 +1549,7 @@ def root_email_update_func(accounts, current_account_id):
                     return False
 
             if resp['Status'] == 'ACCEPTED':
+                response_cache.invalidate((selected_account, 'get_primary_email', None))
                 for y in range(len(accounts)):
                     if accounts[y] == selected_account:
                         change_status[y] = '✔'
@@ -453,100 +1565,736 @@ def root_email_update_func(accounts, current_account_id):
             break
     return True
 
-# Generate report
-def generate_report(current_account_id):
-    resp = {}
-    report = [['Account ID', 'Account Name', 'Status', 'Root Email Address', 'Phone Number', 'Billing Alternate Contact - Name', 'Billing Alternate Contact - Title', 'Billing Alternate Contact - Email', 'Billing Alternate Contact - Phone Number', 'Operations Alternate Contact - Name', 'Operations Alternate Contact - Title', 'Operations Alternate Contact - Email', 'Operations Alternate Contact - Phone Number', 'Security Alternate Contact - Name', 'Security Alternate Contact - Title', 'Security Alternate Contact - Email', 'Security Alternate Contact - Phone Number']]
+# SQLite database of the pipelined root email updates, so that an interrupted update can be resumed (override with CONTACTS_MANAGER_ROOT_EMAIL_STATE_DB)
+ROOT_EMAIL_STATE_DB = os.environ.get('CONTACTS_MANAGER_ROOT_EMAIL_STATE_DB', 'aws-root-email-updates.db')
+
+# Per-account status of a pipelined root email update: PENDING (not started), STARTED (waiting for the OTP), ACCEPTED or FAILED (could not start)
+def open_root_email_state_db(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE IF NOT EXISTS root_email_updates (account_id TEXT PRIMARY KEY, primary_email TEXT, status TEXT, error TEXT, updated_at TEXT)')
+    return connection
 
-    list_of_accounts_id = []
+def set_root_email_status(connection, x, primary_email, status, error=''):
+    connection.execute('INSERT OR REPLACE INTO root_email_updates VALUES (?, ?, ?, ?, ?)', (x, primary_email, status, error, datetime.now().isoformat(timespec='seconds')))
+    connection.commit()
+
+# Load and validate a mapping file of account_id, primary_email rows (CSV, JSON or YAML, like a manifest), returns None if invalid
+def load_root_email_mapping(path):
     try:
-        list_accounts = boto3.client('organizations').list_accounts()
-        list_of_accounts = list_accounts['Accounts']
-        while 'NextToken' in list_accounts:
-            list_accounts = boto3.client('organizations').list_accounts(NextToken=list_accounts['NextToken'])
-            list_of_accounts += list_accounts['Accounts']
-    except ClientError as e:
-        print(f'\n Could not list AWS accounts... Error: {str(e)}')
-        logging.error(e)
-        exit()
-    for account in list_of_accounts:
-        list_of_accounts_id.append(str(account["Id"]))
-        resp[account["Id"]] = account
+        rows = load_manifest(path)
+    except (OSError, ValueError, ImportError) as e:
+        print(f'\n Could not read the mapping file {path}... Error: {str(e)}')
+        return None
+    mapping = {}
+    for index, row in enumerate(rows, 1):
+        x = row.get('account_id', '')
+        primary_email = row.get('primary_email', '')
+        if not re.fullmatch(EMAIL_REGEX, primary_email):
+            print(f'Row {index}: invalid primary_email {primary_email}.')
+            return None
+        if x in mapping:
+            print(f'Row {index}: AWS account ID {x} is mapped more than once.')
+            return None
+        mapping[x] = primary_email
+    if not validate_accounts(list(mapping)):
+        return None
+    return mapping
+
+# Start the root email update of an AWS account, an OTP is sent to the new email address
+def start_primary_email_update(client, x, current_account_id, primary_email):
+    print(f'Starting root email update to {primary_email} for AWS account {x}...')
+    return account_api_call(client, 'start_primary_email_update', x, current_account_id, PrimaryEmail=primary_email)['Status']
+
+# Accept the root email update of an AWS account with the OTP received at the new email address
+def accept_primary_email_update(client, x, current_account_id, primary_email, otp_code):
+    return account_api_call(client, 'accept_primary_email_update', x, current_account_id, Otp=otp_code, PrimaryEmail=primary_email)['Status']
+
+# Pipelined root email update from a mapping file: the updates of all accounts are started concurrently,
+# then the OTPs are accepted in any order as they arrive (each one in the background while the next is typed).
+# The state is saved after every step, running again with the same mapping file resumes where it stopped
+def root_email_pipeline_func(path, current_account_id, state_path=None):
+    green = '\033[92m'
+    cyan = '\033[96m'
+    italic = '\033[0;3m'
+    regular = '\033[0;0m'
+    mapping = load_root_email_mapping(path)
+    if mapping is None:
+        return False
+    client = get_client('account')
+    connection = open_root_email_state_db(state_path or ROOT_EMAIL_STATE_DB)
+    state = {x: (primary_email, status) for x, primary_email, status in connection.execute('SELECT account_id, primary_email, status FROM root_email_updates')}
+
+    # Accounts already started or accepted with the same email address are not started again
+    to_start = [x for x, primary_email in mapping.items() if state.get(x, (None, None)) not in ((primary_email, 'STARTED'), (primary_email, 'ACCEPTED'))]
+    for x in to_start:
+        set_root_email_status(connection, x, mapping[x], 'PENDING')
+    for x, result in zip(to_start, run_concurrently(start_primary_email_update, [(client, x, current_account_id, mapping[x]) for x in to_start], return_exceptions=True)):
+        if isinstance(result, ClientError):
+            logging.error(result)
+            print(f'\n Could not start the root email update of AWS account {x}... Error: {str(result)}')
+            set_root_email_status(connection, x, mapping[x], 'FAILED', str(result))
+        else:
+            set_root_email_status(connection, x, mapping[x], 'STARTED')
 
-    for x in list_of_accounts_id:
-        print(f'Getting information for AWS account {x}...')
-        try:
-            if x == current_account_id:
-                resp_get_contact_information = boto3.client('account').get_contact_information()
+    def status_of(x):
+        return connection.execute('SELECT status FROM root_email_updates WHERE account_id = ?', (x,)).fetchone()[0]
+
+    # Accounts waiting for their OTP, but not the ones whose OTP is being accepted
+    def waiting():
+        in_flight = {x for _, x in futures.values()}
+        return [x for x in mapping if x not in in_flight and status_of(x) == 'STARTED']
+
+    # Stores the outcome of the OTPs accepted and the updates started again in the background
+    def collect(futures, wait=False):
+        for future in [future for future in futures if wait or future.done()]:
+            operation, x = futures.pop(future)
+            try:
+                if operation == 'start':
+                    future.result()
+                    set_root_email_status(connection, x, mapping[x], 'STARTED')
+                elif future.result() == 'ACCEPTED':
+                    set_root_email_status(connection, x, mapping[x], 'ACCEPTED')
+                    print(f'{italic}{cyan}✔ Root email of AWS account {x} updated to {mapping[x]}.{regular}')
+            except ClientError as e:
+                logging.error(e)
+                print(f'\n Could not update the root email of AWS account {x}... Error: {str(e)}')
+                set_root_email_status(connection, x, mapping[x], status_of(x), str(e))
+
+    futures = {}
+    print(f'\n{len(waiting())} AWS account(s) waiting for their OTP.')
+    print('Type "<AWS account ID or new email> <OTP>" for every OTP received, in any order, "resend <AWS account ID>" to send an OTP again, "status" or "quit" (the update can be resumed later).\n')
+    emails = {primary_email.lower(): x for x, primary_email in mapping.items()}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while waiting() or futures:
+            if not waiting():
+                collect(futures, wait=True)
+                continue
+            line = input(f'OTP ({len(waiting())} left): ').strip()
+            collect(futures)
+            words = line.split()
+            if not words:
+                continue
+            elif words[0] == 'quit':
+                break
+            elif words[0] == 'status':
+                for x in mapping:
+                    print(f'{status_of(x):<9} {x} {mapping[x]}')
+            elif words[0] == 'resend' and len(words) == 2 and words[1] in mapping:
+                futures[submit_in_context(executor, start_primary_email_update, client, words[1], current_account_id, mapping[words[1]])] = ('start', words[1])
+            elif len(words) == 2 and emails.get(words[0].lower(), words[0]) in mapping:
+                x = emails.get(words[0].lower(), words[0])
+                futures[submit_in_context(executor, accept_primary_email_update, client, x, current_account_id, mapping[x], words[1])] = ('accept', x)
             else:
-                resp_get_contact_information = boto3.client('account').get_contact_information(AccountId=x)
-            resp[x] = resp[x] | resp_get_contact_information['ContactInformation']
-        except ClientError as e:
-            print(f'\n Could not generate report... Error: {str(e)}')
-            logging.error(e)
-            exit()
+                print('Unknown AWS account, email address or command, try it again.')
+        collect(futures, wait=True)
+
+    statuses = [status_of(x) for x in mapping]
+    connection.close()
+    if all(status == 'ACCEPTED' for status in statuses):
+        print(f'{italic}{green}✔ All new root email updated successfully.{regular}')
+        return True
+    print(f'\n{statuses.count("ACCEPTED")} of {len(mapping)} root email(s) updated, run again with the same mapping file to resume.')
+    return False
+
+# Columns of the contacts report
+REPORT_COLUMNS = ['Account ID', 'Account Name', 'Status', 'Root Email Address', 'Phone Number', 'Billing Alternate Contact - Name', 'Billing Alternate Contact - Title', 'Billing Alternate Contact - Email', 'Billing Alternate Contact - Phone Number', 'Operations Alternate Contact - Name', 'Operations Alternate Contact - Title', 'Operations Alternate Contact - Email', 'Operations Alternate Contact - Phone Number', 'Security Alternate Contact - Name', 'Security Alternate Contact - Title', 'Security Alternate Contact - Email', 'Security Alternate Contact - Phone Number']
+
+# Columns of an alternate contact type in the contacts report
+def alternate_contact_columns(y):
+    return [f'{y} Alternate Contact - {field}' for field in ['Name', 'Title', 'Email', 'Phone Number']]
+
+# Named column selections of the contacts report, the Account ID column is always included
+REPORT_PROFILES = {
+    'full': REPORT_COLUMNS,
+    'primary': ['Account ID', 'Account Name', 'Status', 'Root Email Address', 'Phone Number'],
+    'alternate': ['Account ID', 'Account Name', 'Status'] + [column for y in ['Billing', 'Operations', 'Security'] for column in alternate_contact_columns(y)],
+    'billing': ['Account ID', 'Account Name', 'Status'] + alternate_contact_columns('Billing'),
+    'operations': ['Account ID', 'Account Name', 'Status'] + alternate_contact_columns('Operations'),
+    'security': ['Account ID', 'Account Name', 'Status'] + alternate_contact_columns('Security')
+}
+
+# Resolve a comma-separated list of report columns (case-insensitive) to REPORT_COLUMNS names, in the report order. Returns None if a column is unknown
+def resolve_report_columns(columns):
+    names = {column.lower(): column for column in REPORT_COLUMNS}
+    selected = {'Account ID'}
+    for column in columns.split(','):
+        if column.strip().lower() not in names:
+            print(f'\n{column.strip()} is not a column of the contacts report, the columns are: {", ".join(REPORT_COLUMNS)}.\n')
+            return None
+        selected.add(names[column.strip().lower()])
+    return [column for column in REPORT_COLUMNS if column in selected]
+
+# Report writers receive one row at a time, so memory stays flat and the rows already written are kept if the run fails
+# CSV rows are flushed to disk as they are written
+class CsvReportWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Excel rows are streamed to a write-only worksheet, which openpyxl buffers in a temporary file until the workbook is saved
+# openpyxl is imported on first use, it is only needed for Excel reports
+class XlsxReportWriter:
+    def __init__(self, path, columns):
+        import openpyxl
+        self.path = path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(columns)
+
+    def write_row(self, row):
+        self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+# Parquet rows are written in row groups of batch_size rows (requires pyarrow)
+class ParquetReportWriter:
+    batch_size = 1000
+
+    def __init__(self, path, columns):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = [self.pyarrow.array(column, self.pyarrow.string()) for column in zip(*self.rows)]
+            self.writer.write_table(self.pyarrow.Table.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+REPORT_WRITERS = {'xlsx': XlsxReportWriter, 'csv': CsvReportWriter, 'parquet': ParquetReportWriter}
+
+# Get the report row of an AWS account, only the API calls of the requested columns are made
+def get_report_row(client, x, current_account_id, columns=REPORT_COLUMNS):
+    print(f'Getting information for AWS account {x}...')
+    account = account_inventory.get(x)
+    values = {'Account ID': x, 'Account Name': account.Name, 'Status': account.Status}
+    if 'Phone Number' in columns:
+        contact_information = make_record(PrimaryContact, account_api_call(client, 'get_contact_information', x, current_account_id)['ContactInformation'])
+        values['Phone Number'] = contact_information.PhoneNumber
+    if 'Root Email Address' in columns:
+        if x == current_account_id:
+            values['Root Email Address'] = 'management account - not available'
+        else:
+            values['Root Email Address'] = account_api_call(client, 'get_primary_email', x, current_account_id)['PrimaryEmail']
+    for y in ['Billing', 'Operations', 'Security']:
+        if not any(column in columns for column in alternate_contact_columns(y)):
+            continue
         try:
-            if x == current_account_id:
-                resp[x] = resp[x] | {'PrimaryEmail': 'management account - not available'}
-            else:
-                resp_get_primary_email = boto3.client('account').get_primary_email(AccountId=x)
-                resp_get_primary_email.pop('ResponseMetadata')
-                resp[x] = resp[x] | resp_get_primary_email
+            alternate_contact = make_record(AlternateContact, account_api_call(client, 'get_alternate_contact', x, current_account_id, AlternateContactType=y.upper())['AlternateContact'])
         except ClientError as e:
-            print(f'\n Could not generate report... Error: {str(e)}')
-            logging.error(e)
-            exit()
-        for y in ['Billing','Operations','Security']:
-            try:
-                if x == current_account_id:
-                    resp_get_primary_email = boto3.client('account').get_alternate_contact(AlternateContactType=y.upper())
-                else:
-                    resp_get_primary_email = boto3.client('account').get_alternate_contact(AccountId=x, AlternateContactType=y.upper())
-                resp[x][f'{y}AlternateContact'] = resp_get_primary_email['AlternateContact']
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                    resp[x][f'{y}AlternateContact'] = {'AlternateContactType': 'BILLING', 'EmailAddress': '', 'Name': '', 'PhoneNumber': '', 'Title': ''}
-                else:
-                    print(f'\n Could not generate report... Error: {str(e)}')
-                    logging.error(e)
-                    exit()
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                alternate_contact = AlternateContact('', '', '', '')
+            else:
+                raise
+        values.update(zip(alternate_contact_columns(y), alternate_contact))
+    return [values[column] for column in columns]
+
+# Report rows of all the accounts of the current Organization, each row comes as soon as the calls of its account finish, in the order of the account list
+def report_rows(current_account_id, columns=REPORT_COLUMNS):
+    client = get_client('account')
+    return iter_concurrently(get_report_row, ((client, x, current_account_id, columns) for x in account_inventory.ids()))
+
+# Generate report, of the given columns only (see REPORT_PROFILES)
+def generate_report(current_account_id, report_format='xlsx', columns=REPORT_COLUMNS):
+    report_name = f'aws-contacts-report-{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.{report_format}'
+
+    try:
+        writer = REPORT_WRITERS[report_format](report_name, columns)
+    except ImportError as e:
+        print(f'\n Could not generate the {report_format} report, install its dependency first... Error: {str(e)}')
+        return False
+    snapshot = SnapshotWriter(current_account_id, columns)
+    contact_index = ContactIndexWriter()
 
-    for z in resp:
-        report_account = []
-        report_account.append(resp[z]['Id'])
-        report_account.append(resp[z]['Name'])
-        report_account.append(resp[z]['Status'])
-        report_account.append(resp[z]['PrimaryEmail'])
-        report_account.append(resp[z]['PhoneNumber'])
-        report_account.append(resp[z]['BillingAlternateContact']['Name'])
-        report_account.append(resp[z]['BillingAlternateContact']['Title'])
-        report_account.append(resp[z]['BillingAlternateContact']['EmailAddress'])
-        report_account.append(resp[z]['BillingAlternateContact']['PhoneNumber'])
-        report_account.append(resp[z]['OperationsAlternateContact']['Name'])
-        report_account.append(resp[z]['OperationsAlternateContact']['Title'])
-        report_account.append(resp[z]['OperationsAlternateContact']['EmailAddress'])
-        report_account.append(resp[z]['OperationsAlternateContact']['PhoneNumber'])
-        report_account.append(resp[z]['SecurityAlternateContact']['Name'])
-        report_account.append(resp[z]['SecurityAlternateContact']['Title'])
-        report_account.append(resp[z]['SecurityAlternateContact']['EmailAddress'])
-        report_account.append(resp[z]['SecurityAlternateContact']['PhoneNumber'])
-        report.append(report_account)
-
-    # Create a new Excel workbook
-    workbook = openpyxl.Workbook()
-    # Select the default sheet (usually named 'Sheet')
-    sheet = workbook.active
-    # Add data to the Excel sheet
-    data = report
-    for row in data:
-        sheet.append(row)
-    # Save the workbook to a file
-    workbook.save(f'aws-contacts-report-{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.xlsx')
+    try:
+        for row in report_rows(current_account_id, columns):
+            writer.write_row(row)
+            snapshot.write_row(row)
+            contact_index.write_report_row(row, columns)
+        snapshot.mark_complete()
+    except ClientError as e:
+        print(f'\n Could not generate report... Error: {str(e)}')
+        logging.error(e)
+        return False
+    finally:
+        writer.close()
+        snapshot.close()
+        contact_index.close()
 
+    print(f'\nReport saved to {report_name} (snapshot {snapshot.snapshot_id} saved to {SNAPSHOT_DB})')
+    return True
+
+# Generate one report of the accounts of several Organizations, with an Organization column before the given columns
+# The Organizations are read concurrently and their rows are written as they come, each Organization gets its own snapshot
+def generate_organizations_report(organizations, report_format='xlsx', columns=REPORT_COLUMNS):
+    report_name = f'aws-contacts-report-{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.{report_format}'
+
+    try:
+        writer = REPORT_WRITERS[report_format](report_name, ['Organization'] + columns)
+    except ImportError as e:
+        print(f'\n Could not generate the {report_format} report, install its dependency first... Error: {str(e)}')
+        return False
+    snapshots = {}
+    contact_index = ContactIndexWriter()
+
+    failed = []
+    try:
+        for organization, row in iter_organizations(organizations, failed, lambda: report_rows(get_account_id(), columns)):
+            writer.write_row([organization.name] + row)
+            if organization not in snapshots:
+                snapshots[organization] = SnapshotWriter(organization.account_id, columns)
+            snapshots[organization].write_row(row)
+            contact_index.write_report_row(row, columns)
+        for organization, snapshot in snapshots.items():
+            if organization not in failed:
+                snapshot.mark_complete()
+    finally:
+        writer.close()
+        for snapshot in snapshots.values():
+            snapshot.close()
+        contact_index.close()
+
+    if failed:
+        print(f'\n Could not generate the report of {", ".join(organization.name for organization in failed)}, the rows of the other Organizations are saved to {report_name}')
+        return False
+    print(f'\nReport saved to {report_name} (snapshots {", ".join(f"{organization.name} {snapshot.snapshot_id}" for organization, snapshot in snapshots.items())} saved to {SNAPSHOT_DB})')
     return True
 
-# Main function
+# SQLite database of the report snapshots, one row per account with a content hash (override with CONTACTS_MANAGER_SNAPSHOT_DB)
+SNAPSHOT_DB = os.environ.get('CONTACTS_MANAGER_SNAPSHOT_DB', 'aws-contacts-snapshots.db')
+
+# Columns of the delta report between two snapshots
+DELTA_REPORT_COLUMNS = ['Change', 'Account ID', 'Account Name', 'Field', 'Old Value', 'New Value']
+
+def open_snapshot_db():
+    connection = sqlite3.connect(SNAPSHOT_DB)
+    connection.execute('CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, created_at TEXT, management_account_id TEXT, columns TEXT, complete INTEGER DEFAULT 0)')
+    connection.execute('CREATE TABLE IF NOT EXISTS snapshot_rows (snapshot_id INTEGER, account_id TEXT, row_hash TEXT, row TEXT, PRIMARY KEY (snapshot_id, account_id)) WITHOUT ROWID')
+    return connection
+
+# Stores the report rows as a versioned snapshot, rows are committed in batches as they are written
+class SnapshotWriter:
+    batch_size = 1000
+
+    def __init__(self, current_account_id, columns):
+        self.connection = open_snapshot_db()
+        self.snapshot_id = self.connection.execute(
+            'INSERT INTO snapshots (created_at, management_account_id, columns) VALUES (?, ?, ?)',
+            (datetime.now().isoformat(timespec='seconds'), current_account_id, json.dumps(columns))
+        ).lastrowid
+        self.connection.commit()
+        self.rows = []
+
+    def write_row(self, row):
+        row_json = json.dumps(row, default=str)
+        self.rows.append((self.snapshot_id, str(row[0]), hashlib.blake2b(row_json.encode('UTF-8'), digest_size=8).hexdigest(), row_json))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany('INSERT OR REPLACE INTO snapshot_rows VALUES (?, ?, ?, ?)', self.rows)
+        self.connection.commit()
+        self.rows = []
+
+    # Only complete snapshots are offered for comparison
+    def mark_complete(self):
+        self.flush()
+        self.connection.execute('UPDATE snapshots SET complete = 1 WHERE id = ?', (self.snapshot_id,))
+        self.connection.commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+# List the complete snapshots of the management account, newest first
+def list_snapshots(current_account_id):
+    connection = open_snapshot_db()
+    try:
+        return connection.execute(
+            'SELECT s.id, s.created_at, COUNT(r.account_id) FROM snapshots s LEFT JOIN snapshot_rows r ON r.snapshot_id = s.id '
+            'WHERE s.complete = 1 AND s.management_account_id = ? GROUP BY s.id ORDER BY s.id DESC',
+            (current_account_id,)
+        ).fetchall()
+    finally:
+        connection.close()
+
+# Generate the delta report of the added, removed and changed accounts and fields between two snapshots
+def generate_delta_report(old_snapshot_id, new_snapshot_id, report_format='xlsx'):
+    report_name = f'aws-contacts-delta-report-{old_snapshot_id}-{new_snapshot_id}-{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}.{report_format}'
+    connection = open_snapshot_db()
+    old_columns = json.loads(connection.execute('SELECT columns FROM snapshots WHERE id = ?', (old_snapshot_id,)).fetchone()[0])
+    new_columns = json.loads(connection.execute('SELECT columns FROM snapshots WHERE id = ?', (new_snapshot_id,)).fetchone()[0])
+
+    # Unchanged accounts have the same hash in both snapshots and are filtered out by SQLite
+    delta = connection.execute(
+        'SELECT o.row, n.row FROM snapshot_rows n LEFT JOIN snapshot_rows o ON o.snapshot_id = ? AND o.account_id = n.account_id '
+        'WHERE n.snapshot_id = ? AND (o.row_hash IS NULL OR o.row_hash != n.row_hash) '
+        'UNION ALL '
+        'SELECT o.row, NULL FROM snapshot_rows o WHERE o.snapshot_id = ? AND NOT EXISTS '
+        '(SELECT 1 FROM snapshot_rows n WHERE n.snapshot_id = ? AND n.account_id = o.account_id)',
+        (old_snapshot_id, new_snapshot_id, old_snapshot_id, new_snapshot_id)
+    )
+
+    try:
+        writer = REPORT_WRITERS[report_format](report_name, DELTA_REPORT_COLUMNS)
+    except ImportError as e:
+        print(f'\n Could not generate the {report_format} report, install its dependency first... Error: {str(e)}')
+        connection.close()
+        return False
+
+    changes = {'Added': 0, 'Removed': 0, 'Changed': 0}
+    try:
+        for old_row, new_row in delta:
+            old_row = dict(zip(old_columns, json.loads(old_row))) if old_row else None
+            new_row = dict(zip(new_columns, json.loads(new_row))) if new_row else None
+            if old_row is None:
+                writer.write_row(['Added', new_row['Account ID'], new_row.get('Account Name', ''), '', '', ''])
+                changes['Added'] += 1
+            elif new_row is None:
+                writer.write_row(['Removed', old_row['Account ID'], old_row.get('Account Name', ''), '', '', ''])
+                changes['Removed'] += 1
+            else:
+                fields = [column for column in new_columns if column in old_row and old_row[column] != new_row[column]]
+                for column in fields:
+                    writer.write_row(['Changed', new_row['Account ID'], new_row.get('Account Name', ''), column, old_row[column], new_row[column]])
+                changes['Changed'] += 1 if fields else 0
+    finally:
+        writer.close()
+        connection.close()
+
+    print(f'\n{changes["Added"]} added, {changes["Removed"]} removed and {changes["Changed"]} changed AWS account(s).')
+    print(f'Delta report saved to {report_name}')
+    return True
+
+# SQLite index of the contacts read by the report and list runs, for offline lookups (override with CONTACTS_MANAGER_CONTACT_INDEX_DB, empty disables it)
+CONTACT_INDEX_DB = os.environ.get('CONTACTS_MANAGER_CONTACT_INDEX_DB', 'aws-contacts-index.db')
+
+# Contact types of the index: the alternate contacts, the primary contact and the root email address
+CONTACT_INDEX_TYPES = ['BILLING', 'OPERATIONS', 'SECURITY', 'PRIMARY', 'ROOT']
+
+# Fields that can be queried, by query field name
+CONTACT_INDEX_FIELDS = {'email': 'email', 'name': 'name', 'phone': 'phone'}
+
+# One row per account and contact type. Emails and names are matched case-insensitively and phone numbers are stored normalized,
+# so that exact and prefix queries are index lookups
+def open_contact_index():
+    connection = sqlite3.connect(CONTACT_INDEX_DB)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS contacts (account_id TEXT, contact_type TEXT, account_name TEXT, account_status TEXT, '
+        'name TEXT COLLATE NOCASE, title TEXT, email TEXT COLLATE NOCASE, phone TEXT COLLATE NOCASE, indexed_at TEXT, PRIMARY KEY (account_id, contact_type)) WITHOUT ROWID'
+    )
+    for column in ['email', 'name', 'phone', 'contact_type', 'account_status']:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS contacts_{column} ON contacts ({column})')
+    return connection
+
+# Writes the contacts of report rows and list records to the index, committed in batches like the snapshots
+# A field that is not known (None) keeps its indexed value, a contact that is not set is removed from the index
+class ContactIndexWriter:
+    batch_size = 1000
+
+    def __init__(self, organizations=None):
+        self.connection = open_contact_index() if CONTACT_INDEX_DB else None
+        self.organizations = {organization.name: organization for organization in organizations or []}
+        self.indexed_at = datetime.now().isoformat(timespec='seconds')
+        self.upserts = []
+        self.deletes = []
+
+    def put(self, x, contact_type, account_name=None, account_status=None, name=None, title=None, email=None, phone=None):
+        self.upserts.append((x, contact_type, account_name, account_status, name or None, title or None, email.lower() if email else None, normalize_phone(phone) if phone else None, self.indexed_at))
+        if len(self.upserts) >= self.batch_size:
+            self.flush()
+
+    def delete(self, x, contact_type):
+        self.deletes.append((x, contact_type))
+
+    # Report rows have the given columns of REPORT_COLUMNS, the contacts without columns in the report are left as they are
+    def write_report_row(self, row, columns=REPORT_COLUMNS):
+        values = dict(zip(columns, row))
+        x, account_name, account_status = values['Account ID'], values.get('Account Name'), values.get('Status')
+        if re.fullmatch(EMAIL_REGEX, values.get('Root Email Address') or ''):
+            self.put(x, 'ROOT', account_name, account_status, email=values['Root Email Address'])
+        if 'Phone Number' in values:
+            self.put(x, 'PRIMARY', account_name, account_status, phone=values['Phone Number'])
+        for y in ['Billing', 'Operations', 'Security']:
+            if alternate_contact_columns(y)[2] not in values:
+                continue
+            contact = AlternateContact(*(values.get(column) for column in alternate_contact_columns(y)))
+            if contact.EmailAddress:
+                self.put(x, y.upper(), account_name, account_status, contact.Name, contact.Title, contact.EmailAddress, contact.PhoneNumber)
+            else:
+                self.delete(x, y.upper())
+
+    # List records have an AccountId and the AlternateContact, PrimaryContactInformation or RootEmailAddress of the account
+    # The account name and status come from the account inventory (of the Organization of the record, if it names one) when it is
+    # already loaded, otherwise they are left empty and the index keeps the ones it has
+    def write_record(self, record):
+        x = record['AccountId']
+        organization = self.organizations.get(record.get('Organization'))
+        account = (organization.account_inventory if organization else account_inventory).peek(x)
+        account_name, account_status = (account.Name, account.Status) if account else (None, None)
+        for y, contact in record.get('AlternateContact', {}).items():
+            if contact:
+                self.put(x, y.upper(), account_name, account_status, contact['Name'], contact['Title'], contact['EmailAddress'], contact['PhoneNumber'])
+            else:
+                self.delete(x, y.upper())
+        if record.get('PrimaryContactInformation'):
+            contact = record['PrimaryContactInformation']
+            self.put(x, 'PRIMARY', account_name, account_status, name=contact.get('FullName'), phone=contact.get('PhoneNumber'))
+        if re.fullmatch(EMAIL_REGEX, record.get('RootEmailAddress') or ''):
+            self.put(x, 'ROOT', account_name, account_status, email=record['RootEmailAddress'])
+
+    def flush(self):
+        if self.connection is None:
+            self.upserts, self.deletes = [], []
+            return
+        self.connection.executemany(
+            'INSERT INTO contacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (account_id, contact_type) DO UPDATE SET '
+            'account_name = COALESCE(excluded.account_name, account_name), account_status = COALESCE(excluded.account_status, account_status), '
+            'name = COALESCE(excluded.name, name), title = COALESCE(excluded.title, title), email = COALESCE(excluded.email, email), '
+            'phone = COALESCE(excluded.phone, phone), indexed_at = excluded.indexed_at',
+            self.upserts
+        )
+        self.connection.executemany('DELETE FROM contacts WHERE account_id = ? AND contact_type = ?', self.deletes)
+        self.connection.commit()
+        self.upserts, self.deletes = [], []
+
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+
+# Query the contact index: exact and prefix matches are index lookups, fuzzy matches compare the distinct values of the field
+# field is email, name, phone or any, contact_types and account_status narrow the search
+def query_contacts(value, field='any', match='exact', contact_types=None, account_status=None, limit=100):
+    connection = open_contact_index()
+    try:
+        columns = list(CONTACT_INDEX_FIELDS.values()) if field == 'any' else [CONTACT_INDEX_FIELDS[field]]
+        filters = ''
+        filter_params = []
+        if contact_types:
+            filters += f' AND contact_type IN ({", ".join("?" * len(contact_types))})'
+            filter_params += contact_types
+        if account_status:
+            filters += ' AND account_status = ?'
+            filter_params.append(account_status.upper())
+
+        rows = {}
+        for column in columns:
+            column_value = normalize_phone(value) if column == 'phone' else value
+            if column == 'phone' and not column_value.strip('+'):
+                continue
+            if match == 'fuzzy':
+                candidates = [row[0] for row in connection.execute(f'SELECT DISTINCT {column} FROM contacts WHERE {column} IS NOT NULL{filters}', filter_params)]
+                lowered = {candidate.lower(): candidate for candidate in candidates}
+                matches = [lowered[y] for y in difflib.get_close_matches(column_value.lower(), list(lowered), n=limit, cutoff=0.6)]
+                condition = f'{column} IN ({", ".join("?" * len(matches))})' if matches else '0'
+                params = matches
+            elif match == 'prefix':
+                condition = f"{column} LIKE ? ESCAPE '\\'"
+                params = [re.sub(r'([%_\\])', r'\\\1', column_value) + '%']
+            else:
+                condition = f'{column} = ?'
+                params = [column_value]
+            for row in connection.execute(
+                f'SELECT account_id, account_name, account_status, contact_type, name, title, email, phone, indexed_at FROM contacts WHERE {condition}{filters} LIMIT ?',
+                params + filter_params + [limit]
+            ):
+                rows[(row[0], row[3])] = row
+        return sorted(rows.values())[:limit]
+    finally:
+        connection.close()
+
+# Print the contacts of the index that match a query
+def contact_query_func(value, field='any', match='exact', contact_types=None, account_status=None, limit=100, output_format='table'):
+    if not CONTACT_INDEX_DB or not os.path.exists(CONTACT_INDEX_DB):
+        print(f'\nThe contact index {CONTACT_INDEX_DB} does not exist yet, generate a contacts report or list contacts first.')
+        return False
+    tic = time.perf_counter()
+    rows = query_contacts(value, field, match, contact_types, account_status, limit)
+    toc = time.perf_counter()
+    columns = ['Account ID', 'Account Name', 'Status', 'Contact Type', 'Name', 'Title', 'Email', 'Phone Number', 'Indexed At']
+    if output_format == 'json':
+        for row in rows:
+            print(json.dumps(dict(zip(columns, row))))
+    else:
+        for row in rows:
+            print('  '.join(str(column or '-') for column in row))
+    print(f'\n{len(rows)} contact(s) found in {(toc - tic) * 1000:0.1f} ms (index {CONTACT_INDEX_DB}).')
+    return True
+
+# Fields of the contacts in a manifest, by contact type
+MANIFEST_CONTACT_TYPES = ['billing', 'operations', 'security', 'primary']
+
+# Columns of the manifest results file
+MANIFEST_RESULTS_COLUMNS = ['Row', 'Target', 'Contact Type', 'Account ID', 'Status', 'Error']
+
+# Read a CSV, JSON or YAML manifest, a list of rows with a target, a contact_type and the contact fields
+def load_manifest(path):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as f:
+        if extension == '.csv':
+            rows = list(csv.DictReader(f))
+        elif extension == '.json':
+            rows = json.load(f)
+        elif extension in ('.yaml', '.yml'):
+            import yaml
+            rows = yaml.safe_load(f)
+        else:
+            raise ValueError('the manifest must be a .csv, .json, .yaml or .yml file')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('the manifest must be a list of rows')
+    # Empty CSV cells are dropped, so that optional fields can be left blank
+    return [{str(key).strip(): str(value).strip() for key, value in row.items() if key and value is not None and str(value).strip() != ''} for row in rows]
+
+# Validate the manifest rows, returns the list of errors
+def validate_manifest(rows):
+    errors = []
+    for index, row in enumerate(rows, start=1):
+        contact_type = row.get('contact_type', '').lower()
+        if 'target' not in row:
+            errors.append(f'Row {index}: the target field is required.')
+        if contact_type not in MANIFEST_CONTACT_TYPES:
+            errors.append(f'Row {index}: the contact_type must be one of {", ".join(MANIFEST_CONTACT_TYPES)}.')
+            continue
+        required_fields = PRIMARY_CONTACT_REQUIRED_FIELDS if contact_type == 'primary' else ALTERNATE_CONTACT_FIELDS
+        for key in required_fields:
+            if key not in row:
+                errors.append(f'Row {index}: the {key} field cannot be empty.')
+    return errors
+
+# Apply a manifest of per-account or per-OU alternate and primary contacts as one batched job
+def apply_manifest(path, current_account_id, dry_run=False, results_path=None):
+    client = get_client('account')
+
+    try:
+        rows = load_manifest(path)
+    except (OSError, ValueError, ImportError) as e:
+        print(f'\n Could not read the manifest {path}... Error: {str(e)}')
+        return False
+    errors = validate_manifest(rows)
+    if errors:
+        print('\n'.join(errors))
+        return False
+
+    # Later rows override earlier ones, so an OU-wide contact can be refined for single accounts
+    assignments = {}
+    for index, row in enumerate(rows):
+        contact_type = row['contact_type'].lower()
+        if contact_type == 'primary':
+            contact = {key: row[key] for key in PRIMARY_CONTACT_REQUIRED_FIELDS + PRIMARY_CONTACT_OPTIONAL_FIELDS if key in row}
+        else:
+            contact = {key: row[key] for key in ALTERNATE_CONTACT_FIELDS}
+        accounts = resolve_selector(row['target'])
+        if accounts is None:
+            return False
+        for x in accounts:
+            assignments[(x, contact_type)] = (index, contact)
+
+    if not validate_accounts(sorted({x for x, _ in assignments})):
+        return False
+    print(f'Manifest: {len(rows)} row(s), {len(assignments)} contact(s) to apply\n')
+
+    # The contacts completed by a previous run of the same manifest are skipped
+    journal = Journal('apply', rows)
+    status = {key: ('Already applied', '') for key in assignments if journal.completed(key)}
+
+    # Alternate contact items are (client, account, current account, type), primary contact items are (client, account, current account)
+    alternate_items = [(client, x, current_account_id, y.capitalize()) for x, y in assignments if y != 'primary' and (x, y) not in status]
+    primary_items = [(client, x, current_account_id) for x, y in assignments if y == 'primary' and (x, y) not in status]
+    alternate_desired = [assignments[contact_key(item)][1] for item in alternate_items]
+    primary_desired = [assignments[contact_key(item)][1] for item in primary_items]
+
+    # The current contacts are always read, as the before-images of the journal
+    before = {}
+    for get_func, items, desired in ((get_alternate_contact, alternate_items, alternate_desired), (get_contact_information, primary_items, primary_desired)):
+        plan = plan_updates(get_func, items, desired)
+        before.update(plan['Before'])
+        if DIFF_MODE:
+            for item in plan['Unchanged']:
+                status[contact_key(item)] = ('Unchanged', '')
+        for item, e in plan['Failed']:
+            status[contact_key(item)] = ('Failed', e.response['Error']['Message'])
+
+    # Every contact left is written, unless it is a dry run
+    alternate_writes = [item + tuple(assignments[contact_key(item)][1][key] for key in ['EmailAddress', 'Name', 'PhoneNumber', 'Title']) for item in alternate_items if contact_key(item) not in status]
+    primary_writes = [item + (assignments[contact_key(item)][1],) for item in primary_items if contact_key(item) not in status]
+    if dry_run:
+        for item in alternate_writes + primary_writes:
+            status[contact_key(item)] = ('Would update', '')
+    else:
+        journal.write_outcomes([key for key, result in status.items() if result[0] == 'Unchanged'], 'UNCHANGED')
+        journal.write_outcomes([key for key, result in status.items() if result[0] == 'Failed'], 'FAILED')
+        results = []
+        for put_func, items in ((put_alternate_contact, alternate_writes), (put_contact_information, primary_writes)):
+            items_results = run_journaled(journal, [(contact_key(item), before[contact_key(item)], assignments[contact_key(item)][1], put_func, item) for item in items])
+            for item, result in zip(items, items_results):
+                status[contact_key(item)] = ('Failed', result.response['Error']['Message']) if isinstance(result, ClientError) else ('Updated', '')
+            results += items_results
+        report_journal(journal, results)
+
+    # Per-row results
+    results = [[index + 1, rows[index]['target'], contact_type, x] + list(status[(x, contact_type)]) for (x, contact_type), (index, _) in assignments.items()]
+    results.sort(key=lambda result: (result[0], result[3]))
+    print('')
+    for index, row in enumerate(rows):
+        row_results = [result[4] for result in results if result[0] == index + 1]
+        counts = ', '.join(f'{row_results.count(x)} {x.lower()}' for x in ('Updated', 'Would update', 'Unchanged', 'Already applied', 'Failed') if x in row_results)
+        print(f'Row {index + 1} ({row["target"]}, {row["contact_type"].lower()}): {len(row_results)} AWS account(s) - {counts or "overridden by later rows"}')
+    for result in results:
+        if result[4] == 'Failed':
+            print(f'  ✗ Row {result[0]} {result[3]} {result[2]}: {result[5]}')
+
+    if results_path:
+        with open(results_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(MANIFEST_RESULTS_COLUMNS)
+            writer.writerows(results)
+        print(f'\nResults saved to {results_path}')
+
+    return all(result[4] != 'Failed' for result in results)
+
+# Report format choice menu
+def choose_report_format():
+    from simple_term_menu import TerminalMenu
+    options_6 = ['Excel (xlsx)', 'CSV', 'Parquet']
+    terminal_menu_6 = TerminalMenu(options_6, title='Choose the report format:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
+    menu_entry_index_6 = terminal_menu_6.show()
+    print(f'Report format: {options_6[menu_entry_index_6]}\n')
+    return list(REPORT_WRITERS)[menu_entry_index_6]
+
+# Report profile choice menu, a narrower profile makes fewer API calls per account
+def choose_report_profile():
+    from simple_term_menu import TerminalMenu
+    options_7 = ['Full (5 API calls per account)', 'Primary contact and root email (2 API calls per account)', 'Alternate contacts (3 API calls per account)', 'Billing contact (1 API call per account)', 'Operations contact (1 API call per account)', 'Security contact (1 API call per account)']
+    terminal_menu_7 = TerminalMenu(options_7, title='Choose the report columns:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
+    menu_entry_index_7 = terminal_menu_7.show()
+    print(f'Report columns: {options_7[menu_entry_index_7]}\n')
+    return REPORT_PROFILES[list(REPORT_PROFILES)[menu_entry_index_7]]
+
+# Main function, the interactive menu (simple_term_menu is only imported in interactive mode)
 def main():
+    from simple_term_menu import TerminalMenu
     while(True):
         bold = '\033[1m'
         italic = '\033[0;3m'
@@ -560,7 +2308,7 @@ def main():
         print(f'{italic}Solution developed for batch management of AWS accounts contacts. For more information, visit: https://github.com/aws-samples/aws-contacts-manager.\n{regular}')
 
         # First choice menu
-        options_0 = ['Alternate contacts', 'Primary contacts information', 'Root email addresses', 'Generate contacts report']
+        options_0 = ['Alternate contacts', 'Primary contacts information', 'Root email addresses', 'Generate contacts report', 'Compare contacts reports']
         terminal_menu_0 = TerminalMenu(options_0, title='Choose the contact type or report:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
         menu_entry_index_0 = terminal_menu_0.show()
         menu_entry_0 = options_0[menu_entry_index_0]
@@ -576,21 +2324,10 @@ def main():
             menu_entry_index_1 = terminal_menu_1.show()
             menu_entry_1 = options_1[menu_entry_index_1]
             print(f'{italic}{cyan}You have selected to {underline}{menu_entry_1}{regular}{italic}{cyan} AWS account(s) {underline}{menu_entry_0}{regular}{italic}{cyan}!{regular}\n')
-            if menu_entry_1 == 'Delete':
-                accounts = input('AWS account ID (delete action allowed for one AWS account at a time): ')
-                accounts = accounts.split(',')
-            else:
-                accounts = input('AWS account ID(s) (enter a list of AWS account IDs separated by comma / Organizational unit ID / all): ')
-                if accounts == 'all':
-                    accounts = list_accounts_func()
-                elif accounts[:2] in ('ou', 'r-'):
-                    accounts = list_ou_accounts_func(accounts)
-                else:
-                    accounts = accounts.replace(' ', '')
-                    accounts = accounts.split(',')
+            accounts = resolve_selector(input(ACCOUNTS_PROMPT))
 
             # Validator if the AWS Account ID is valid and is within the Organizations
-            account_check = validate_accounts(accounts)
+            account_check = accounts is not None and validate_accounts(accounts)
             if account_check == False:
                 exit()
             else:
@@ -609,18 +2346,12 @@ def main():
             else:
                 menu_entry_2_list = [menu_entry_2]
 
-            tic = time.perf_counter()
-
             if menu_entry_1 == 'List':
-                resp = alternate_contact_list_func(accounts, current_account_id, menu_entry_2_list)
+                run_command(alternate_contact_list_func, accounts, current_account_id, menu_entry_2_list)
             elif menu_entry_1 == 'Update':
-                resp = alternate_contact_update_func(accounts, current_account_id, menu_entry_2_list)
+                run_command(alternate_contact_update_func, accounts, current_account_id, menu_entry_2_list)
             else:
-                resp = alternate_contact_delete_func(accounts, current_account_id, menu_entry_2_list)
-
-            toc = time.perf_counter()
-
-            print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: somethig went wrong.\n')
+                run_command(alternate_contact_delete_func, accounts, current_account_id, menu_entry_2_list)
 
         # Primary contacts information choice
         elif menu_entry_0 == 'Primary contacts information':
@@ -629,39 +2360,25 @@ def main():
             menu_entry_index_3 = terminal_menu_3.show()
             menu_entry_3 = options_3[menu_entry_index_3]
             print(f'{italic}{cyan}You have selected to {underline}{menu_entry_3}{regular}{italic}{cyan} AWS account(s) {underline}{menu_entry_0}{regular}{italic}{cyan}!{regular}\n')
-            accounts = input('AWS account ID(s) (enter a list of AWS account IDs separated by comma / Organizational unit ID / all): ')
-            if accounts == 'all':
-                accounts = list_accounts_func()
-            elif accounts[:2] in ('ou', 'r-'):
-                accounts = list_ou_accounts_func(accounts)
-            else:
-                accounts = accounts.replace(' ', '')
-                accounts = accounts.split(',')
+            accounts = resolve_selector(input(ACCOUNTS_PROMPT))
 
             # Validator if the AWS Account ID is valid and is within the Organizations
-            account_check = validate_accounts(accounts)
+            account_check = accounts is not None and validate_accounts(accounts)
             if account_check == False:
                 exit()
             else:
                 print(f'AWS account validation: {bold}{green}\u2713{regular}')
 
-            accounts = list(set(accounts))
             print(f'Number of individual AWS accounts detected: {len(accounts)}\n')
 
-            tic = time.perf_counter()
-
             if menu_entry_3 == 'List':
-                resp = primary_contact_list_func(accounts, current_account_id)
+                run_command(primary_contact_list_func, accounts, current_account_id)
             else:
-                resp = primary_contact_update_func(accounts, current_account_id)
-
-            toc = time.perf_counter()
-
-            print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: somethig went wrong.\n')
+                run_command(primary_contact_update_func, accounts, current_account_id)
 
         # Root email addresses choice
         elif menu_entry_0 == 'Root email addresses':
-            options_4 = ['List', 'Update']
+            options_4 = ['List', 'Update', 'Update from a mapping file']
             terminal_menu_4 = TerminalMenu(options_4, title='Choose the action:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
             menu_entry_index_4 = terminal_menu_4.show()
             menu_entry_4 = options_4[menu_entry_index_4]
@@ -669,74 +2386,72 @@ def main():
 
             if menu_entry_4 == 'List':
                 print(f'{bold}{yellow}Note: {regular}{yellow}the management account is not supported. If added, value will be "management account - not available".{regular}\n')
-                accounts = input('AWS account ID(s) (enter a list of AWS account IDs separated by comma / Organizational unit ID / all): ')
-                if accounts == 'all':
-                    accounts = list_accounts_func()
-                elif accounts[:2] in ('ou', 'r-'):
-                    accounts = list_ou_accounts_func(accounts)
-                else:
-                    accounts = accounts.replace(' ', '')
-                    accounts = accounts.split(',')
+                accounts = resolve_selector(input(ACCOUNTS_PROMPT))
 
                 # Validator if the AWS Account ID is valid and is within the Organizations
-                account_check = validate_accounts(accounts)
+                account_check = accounts is not None and validate_accounts(accounts)
                 if account_check == False:
                     exit()
                 else:
                     print(f'AWS account validation: {bold}{green}\u2713{regular}')
 
-                accounts = list(set(accounts))
                 print(f'Number of individual AWS accounts detected: {len(accounts)}\n')
 
-                tic = time.perf_counter()
-
-                resp = root_email_list_func(accounts, current_account_id)
+                run_command(root_email_list_func, accounts, current_account_id)
 
-                toc = time.perf_counter()
+            elif menu_entry_4 == 'Update from a mapping file':
+                print(f'{bold}{yellow}Note: {regular}{yellow}the mapping file is a CSV, JSON or YAML file of account_id, primary_email rows. All the updates are started at once, then the OTPs can be typed in any order.\n{regular}')
+                mapping_path = input('Mapping file: ')
 
-                print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: somethig went wrong.\n')
+                run_command(root_email_pipeline_func, mapping_path, current_account_id)
 
             else:
-                print(f'{bold}{yellow}Note: {regular}{yellow}For security reasons and better experience, only 15 AWS accounts are allowed at a time.\n{regular}')
-                accounts = input('AWS account ID(s) (enter a list of AWS account IDs separated by comma / Organizational unit ID / all): ')
-                if accounts == 'all':
-                    accounts = list_accounts_func()
-                elif accounts[:2] in ('ou', 'r-'):
-                    accounts = list_ou_accounts_func(accounts)
-                else:
-                    accounts = accounts.replace(' ', '')
-                    accounts = accounts.split(',')
+                print(f'{bold}{yellow}Note: {regular}{yellow}For security reasons and better experience, only 15 AWS accounts are allowed at a time (use a mapping file for more).\n{regular}')
+                accounts = resolve_selector(input(ACCOUNTS_PROMPT))
 
                 # Validator if the AWS Account ID is valid and is within the Organizations
-                account_check = validate_accounts(accounts)
+                account_check = accounts is not None and validate_accounts(accounts)
                 if account_check == False:
                     exit()
                 else:
                     print(f'AWS account validation: {bold}{green}\u2713{regular}')
 
-                accounts = list(set(accounts))
                 print(f'Number of individual AWS accounts detected: {len(accounts)}\n')
 
                 if len(accounts) > 15:
                     print('Error: there are more than 15 AWS accounts selected, please segment into groups of up to 15 AWS accounts to continue.')
                 else:
-                    tic = time.perf_counter()
+                    run_command(root_email_update_func, accounts, current_account_id)
+        # Generate contacts report
+        elif menu_entry_0 == 'Generate contacts report':
+            print(f'{bold}{yellow}Note: {regular}{yellow}the management account is not supported to get root email address, value will be "management account - not available".{regular}\n')
 
-                    resp = root_email_update_func(accounts, current_account_id)
+            report_format = choose_report_format()
+            report_columns = choose_report_profile()
 
-                    toc = time.perf_counter()
+            run_command(generate_report, current_account_id, report_format, report_columns)
 
-                    print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: somethig went wrong.\n')
-        # Generate contacts report
+        # Compare contacts reports
         else:
-            print(f'{bold}{yellow}Note: {regular}{yellow}the management account is not supported to get root email address, value will be "management account - not available".{regular}\n')
-            tic = time.perf_counter()
-
-            resp = generate_report(current_account_id)
+            snapshots = list_snapshots(current_account_id)
+            if len(snapshots) < 2:
+                print(f'{bold}{yellow}Note: {regular}{yellow}at least two complete contacts reports are needed to compare, generate a new report first.{regular}\n')
+            else:
+                options_7 = [f'Snapshot {x[0]} - {x[1]} ({x[2]} AWS accounts)' for x in snapshots]
+                terminal_menu_7 = TerminalMenu(options_7, title='Choose the newer contacts report:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
+                new_snapshot = snapshots[terminal_menu_7.show()]
+                older_snapshots = [x for x in snapshots if x[0] < new_snapshot[0]]
+                if not older_snapshots:
+                    print('Error: there is no older contacts report to compare with.')
+                else:
+                    options_8 = [f'Snapshot {x[0]} - {x[1]} ({x[2]} AWS accounts)' for x in older_snapshots]
+                    terminal_menu_8 = TerminalMenu(options_8, title='Choose the older contacts report:', menu_cursor_style=('fg_cyan', 'bold'), clear_screen=False)
+                    old_snapshot = older_snapshots[terminal_menu_8.show()]
+                    print(f'Comparing snapshot {old_snapshot[0]} ({old_snapshot[1]}) with snapshot {new_snapshot[0]} ({new_snapshot[1]})\n')
 
-            toc = time.perf_counter()
+                    report_format = choose_report_format()
 
-            print(f'\nCompleted successfully in {toc - tic:0.4f} seconds!\n') if resp == True else print('\nERROR: somethig went wrong.\n')
+                    run_command(generate_delta_report, old_snapshot[0], new_snapshot[0], report_format)
 
         resp_end = input('Would you like to run the AWS Contats Manager tool again? (y/N): ')
         if resp_end.lower() in ('y', 'yes'):
@@ -744,5 +2459,135 @@ def main():
         else:
             break
 
+# Command line entry point, the interactive menu runs when no command is given
+def cli(argv=None):
+    global MAX_WORKERS, ACCOUNT_API_TPS, DIFF_MODE, METRICS_FILE, RESPONSE_CACHE_FRESH
+    parser = argparse.ArgumentParser(description='Contacts Manager - batch management of AWS accounts contacts. Run without a command for the interactive menu.')
+    parser.add_argument('--max-workers', type=int, help=f'number of concurrent API calls (default: {MAX_WORKERS})')
+    parser.add_argument('--tps', type=float, help=f'requests per second for each Account Management API operation (default: {ACCOUNT_API_TPS:g})')
+    parser.add_argument('--metrics', help='JSON file to save the per-operation API metrics (latency, retries, throttles, errors) of every run to')
+    parser.add_argument('--fresh', action='store_true', help='read the contacts from AWS instead of the response cache')
+    parser.add_argument('--orgs', default=ORGANIZATIONS, help='comma-separated AWS CLI profiles or IAM role ARNs of the management accounts to work on, each optionally named with name=, '
+                        'several Organizations are read concurrently by the report and list commands (e.g. prod=prod-admin,sandbox=arn:aws:iam::111122223333:role/ContactsManager)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    apply_parser = subparsers.add_parser('apply', help='apply a CSV, JSON or YAML manifest of alternate and primary contacts per AWS account or OU')
+    apply_parser.add_argument('manifest', help='manifest file, rows with target (AWS account IDs / Organizational unit IDs / root ID / all / tag:key=value, prefix with ! to exclude), contact_type (billing / operations / security / primary) and the contact fields')
+    apply_parser.add_argument('--dry-run', action='store_true', help='only print what would be updated')
+    apply_parser.add_argument('--no-diff', action='store_true', help='write every contact, including the ones that are already up to date')
+    apply_parser.add_argument('--results', help='CSV file to save the per-account results to')
+
+    root_email_parser = subparsers.add_parser('update-root-emails', help='update root email addresses from a mapping file: all updates are started at once, then the OTPs are accepted in any order')
+    root_email_parser.add_argument('mapping', help='CSV, JSON or YAML file of account_id, primary_email rows')
+    root_email_parser.add_argument('--state', help=f'SQLite file of the per-account update status, to resume an interrupted update (default: {ROOT_EMAIL_STATE_DB})')
+
+    delete_parser = subparsers.add_parser('delete', help='delete the alternate contacts of AWS accounts: the contacts that are set are read first, then deleted in parallel after one confirmation')
+    delete_parser.add_argument('target', help='comma-separated AWS account IDs, Organizational unit IDs (nested OUs included), root ID, all or tag:key=value, prefix with ! to exclude')
+    delete_parser.add_argument('--types', default='billing,operations,security', help='comma-separated alternate contact types (default: billing,operations,security)')
+    delete_parser.add_argument('--dry-run', action='store_true', help='only print what would be deleted')
+    delete_parser.add_argument('--yes', action='store_true', help='delete without asking for confirmation')
+    delete_parser.add_argument('--results', help='CSV file to save the per-account results to')
+
+    report_parser = subparsers.add_parser('report', help='generate the contacts report of all the Organization accounts without the interactive menu')
+    report_parser.add_argument('--format', choices=list(REPORT_WRITERS), default='csv', help='report format (default: csv)')
+    report_parser.add_argument('--profile', choices=list(REPORT_PROFILES), default='full', help='named column selection, only the API calls of its columns are made (default: full)')
+    report_parser.add_argument('--columns', help='comma-separated report columns, e.g. "Account Name,Security Alternate Contact - Email" (overrides --profile)')
+
+    rollback_parser = subparsers.add_parser('rollback', help='restore the contacts written by an update, delete or apply job from its journal, in parallel')
+    rollback_parser.add_argument('journal', help=f'journal file of the job (in {JOURNAL_DIR})')
+    rollback_parser.add_argument('--yes', action='store_true', help='restore without asking for confirmation')
+    rollback_parser.add_argument('--force', action='store_true', help='also restore the contacts changed since the job')
+
+    query_parser = subparsers.add_parser('query', help='find the accounts using a contact in the local contact index, filled by the report and list runs')
+    query_parser.add_argument('value', help='email address, name or phone number to look for')
+    query_parser.add_argument('--field', choices=['any', 'email', 'name', 'phone'], default='any', help='field to match (default: any)')
+    query_parser.add_argument('--match', choices=['exact', 'prefix', 'fuzzy'], default='exact', help='exact (case-insensitive), prefix or fuzzy match (default: exact)')
+    query_parser.add_argument('--type', help='comma-separated contact types: billing, operations, security, primary, root (default: all)')
+    query_parser.add_argument('--status', help='account status, e.g. ACTIVE or SUSPENDED (default: all)')
+    query_parser.add_argument('--limit', type=int, default=100, help='maximum number of contacts (default: 100)')
+    query_parser.add_argument('--json', action='store_true', help='print JSON lines instead of a table')
+
+    list_parser = subparsers.add_parser('list', help='list the contacts of AWS accounts without the interactive menu')
+    list_parser.add_argument('contact', choices=['alternate', 'primary', 'root-email'], help='contacts to list')
+    list_parser.add_argument('target', help='comma-separated AWS account IDs, Organizational unit IDs (nested OUs included), root ID, all or tag:key=value, prefix with ! to exclude')
+    list_parser.add_argument('--types', default='billing,operations,security', help='comma-separated alternate contact types (default: billing,operations,security)')
+    list_parser.add_argument('--output', help='gzip JSON lines file or s3://bucket/key to export to (default: print to terminal)')
+
+    args = parser.parse_args(argv)
+    if args.max_workers:
+        MAX_WORKERS = args.max_workers
+    if args.tps:
+        ACCOUNT_API_TPS = args.tps
+    if args.metrics:
+        METRICS_FILE = args.metrics
+    if args.fresh:
+        RESPONSE_CACHE_FRESH = True
+    organizations = parse_organizations(args.orgs)
+    if len({organization.name for organization in organizations}) != len(organizations):
+        parser.error(f'duplicate Organization names: {args.orgs}')
+    if len(organizations) == 1:
+        current_organization.set(organizations[0])
+    elif len(organizations) > 1 and args.command not in ('report', 'list'):
+        parser.error('several Organizations are only supported by the report and list commands')
+
+    if args.command == 'apply':
+        if args.no_diff:
+            DIFF_MODE = False
+        exit(0 if run_command(apply_manifest, args.manifest, get_account_id(), args.dry_run, args.results) else 1)
+    elif args.command == 'update-root-emails':
+        exit(0 if run_command(root_email_pipeline_func, args.mapping, get_account_id(), args.state) else 1)
+    elif args.command == 'delete':
+        alternate_contact_types = [x.strip().capitalize() for x in args.types.split(',')]
+        if not set(alternate_contact_types) <= {'Billing', 'Operations', 'Security'}:
+            parser.error(f'invalid alternate contact type(s): {args.types}')
+        accounts = resolve_selector(args.target)
+        if accounts is None or not validate_accounts(accounts):
+            exit(1)
+        current_account_id = get_account_id()
+        exit(0 if run_command(alternate_contact_delete_func, accounts, current_account_id, alternate_contact_types, args.dry_run, args.yes, args.results) else 1)
+    elif args.command == 'report':
+        columns = resolve_report_columns(args.columns) if args.columns else REPORT_PROFILES[args.profile]
+        if columns is None:
+            exit(1)
+        if len(organizations) > 1:
+            resp = run_command(generate_organizations_report, organizations, args.format, columns)
+        else:
+            resp = run_command(generate_report, get_account_id(), args.format, columns)
+        exit(0 if resp else 1)
+    elif args.command == 'rollback':
+        exit(0 if run_command(rollback_journal, args.journal, get_account_id(), args.yes, args.force) else 1)
+    elif args.command == 'query':
+        contact_types = [x.strip().upper() for x in args.type.split(',')] if args.type else None
+        if contact_types and not set(contact_types) <= set(CONTACT_INDEX_TYPES):
+            parser.error(f'invalid contact type(s): {args.type}')
+        resp = contact_query_func(args.value, args.field, args.match, contact_types, args.status, args.limit, 'json' if args.json else 'table')
+        exit(0 if resp else 1)
+    elif args.command == 'list':
+        alternate_contact_types = [x.strip().capitalize() for x in args.types.split(',')]
+        if args.contact == 'alternate' and not set(alternate_contact_types) <= {'Billing', 'Operations', 'Security'}:
+            parser.error(f'invalid alternate contact type(s): {args.types}')
+        if len(organizations) <= 1:
+            accounts = resolve_selector(args.target)
+            if accounts is None:
+                exit(1)
+            current_account_id = get_account_id()
+        try:
+            exporter = output_exporter(args.output)
+        except ClientError as e:
+            logging.error(e)
+            print(e)
+            exit(1)
+        if len(organizations) > 1:
+            resp = run_command(organizations_list_func, organizations, args.contact, args.target, alternate_contact_types, exporter)
+        elif args.contact == 'alternate':
+            resp = run_command(alternate_contact_list_func, accounts, current_account_id, alternate_contact_types, exporter)
+        elif args.contact == 'primary':
+            resp = run_command(primary_contact_list_func, accounts, current_account_id, exporter)
+        else:
+            resp = run_command(root_email_list_func, accounts, current_account_id, exporter)
+        exit(0 if resp else 1)
+    else:
+        main()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file